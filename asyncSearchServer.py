@@ -0,0 +1,302 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from searchServer import ServingState, parseSearchParams
+
+# Number of latencies kept per batch size for the percentiles
+LATENCY_WINDOW = 10000
+
+class MicroBatcher():
+
+	def __init__(self, scoreBatch, max_batch_size=32, max_wait=0.005):
+		"""
+		Collects concurrent requests into micro-batches, scored together in
+		a worker thread, and hands each request its own result
+
+		A batch is closed when it holds max_batch_size requests, or
+		max_wait seconds after its first request arrived. The next batch
+		is collected while the current one is being scored
+
+		Parameters
+		----------
+		arg1 : function
+			Scores a list of requests, returns the list of their results.
+			A result that is an exception fails its request only
+		arg2 : int
+			Maximum number of requests per batch
+		arg3 : float
+			Maximum time (seconds) a request waits for the batch to fill
+		"""
+
+		self.scoreBatch = scoreBatch
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait
+		self.queue = None
+		self.executor = ThreadPoolExecutor(1)
+		self.task = None
+
+		# per batch size - number of batches, scoring time and request latencies
+		self.batches = {}
+		self.score_times = {}
+		self.latencies = {}
+
+	def start(self):
+		"""
+		Starts collecting batches, in the running event loop
+		"""
+		self.queue = asyncio.Queue()
+		self.task = asyncio.ensure_future(self.run())
+
+	async def submit(self, request):
+		"""
+		Queues a request and waits for its result
+		"""
+		future = asyncio.get_event_loop().create_future()
+		await self.queue.put((request, future, time.time()))
+		return await future
+
+	async def run(self):
+		loop = asyncio.get_event_loop()
+		while True:
+			batch = [await self.queue.get()]
+			deadline = loop.time() + self.max_wait
+			while len(batch) < self.max_batch_size:
+				if not self.queue.empty():
+					batch.append(self.queue.get_nowait())
+					continue
+				timeout = deadline - loop.time()
+				if timeout <= 0:
+					break
+				try:
+					batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+				except asyncio.TimeoutError:
+					break
+
+			start = time.time()
+			try:
+				results = await loop.run_in_executor(self.executor, self.scoreBatch,
+					[request for request, future, arrival in batch])
+			except Exception as error:
+				for request, future, arrival in batch:
+					if not future.done():
+						future.set_exception(error)
+				continue
+			end = time.time()
+
+			for (request, future, arrival), result in zip(batch, results):
+				if future.done():
+					continue
+				if isinstance(result, Exception):
+					future.set_exception(result)
+				else:
+					future.set_result(result)
+			self.record(len(batch), end - start, [end - arrival for request, future, arrival in batch])
+
+	def record(self, batch_size, score_time, latencies):
+		"""
+		Adds a scored batch to the statistics
+		"""
+		if batch_size not in self.batches:
+			self.batches[batch_size] = 0
+			self.score_times[batch_size] = 0.0
+			self.latencies[batch_size] = deque(maxlen=LATENCY_WINDOW)
+		self.batches[batch_size] += 1
+		self.score_times[batch_size] += score_time
+		self.latencies[batch_size].extend(latencies)
+
+	def stats(self):
+		"""
+		Throughput (queries per second of scoring) and latency percentiles
+		(from arrival to result, over the last LATENCY_WINDOW queries) per
+		batch size
+		"""
+
+		stats = {}
+		for batch_size in sorted(self.batches):
+			latencies = np.array(self.latencies[batch_size]) * 1000
+			queries = self.batches[batch_size] * batch_size
+			stats[str(batch_size)] = {
+				"batches" : self.batches[batch_size],
+				"queries" : queries,
+				"throughput_qps" : round(queries / self.score_times[batch_size], 2) if self.score_times[batch_size] > 0 else None,
+				"p50_latency_ms" : round(float(np.percentile(latencies, 50)), 3),
+				"p99_latency_ms" : round(float(np.percentile(latencies, 99)), 3)
+			}
+		return stats
+
+
+class AsyncSearchServer():
+
+	def __init__(self, createEngine, host="127.0.0.1", port=8000, max_batch_size=32, max_wait=0.005):
+		"""
+		An asyncio HTTP front end over a ServingState, that scores concurrent
+		queries in micro-batches (see MicroBatcher) - one matrix product per
+		model and batch instead of one per query
+
+		- GET /search?q=...&k=...&model=... - as SearchServer
+		- GET /health - the status of the server and of the index
+		- GET /stats - throughput and latency per batch size
+		- POST (or GET) /reload - as SearchServer
+
+		Parameters
+		----------
+		arg1 : function
+			Creates the SearchEngine of a model number
+		arg2 : str
+			Host to listen on
+		arg3 : int
+			Port to listen on
+		arg4 : int
+			Maximum number of queries per batch
+		arg5 : float
+			Maximum time (seconds) a query waits for its batch to fill
+		"""
+
+		self.createEngine = createEngine
+		self.host = host
+		self.port = port
+		self.state = None
+		self.reload_thread = None
+		self.reload_error = None
+		self.batcher = MicroBatcher(self.scoreBatch, max_batch_size, max_wait)
+
+	def load(self):
+		"""
+		Loads (or builds) the index, and replaces the current one once it is ready
+		"""
+
+		try:
+			state = ServingState(self.createEngine)
+			previous, self.state = self.state, state # batches being scored keep the state they started with
+			self.reload_error = None
+			if previous is not None:
+				previous.retire()
+		except Exception as error:
+			self.reload_error = str(error)
+			print("Reload failed : " + self.reload_error)
+
+	def reload(self):
+		"""
+		Starts a reload in the background, unless one is running already,
+		see SearchServer.reload
+		"""
+
+		if self.reload_thread is not None and self.reload_thread.is_alive():
+			return False
+		self.reload_thread = threading.Thread(target=self.load)
+		self.reload_thread.daemon = True
+		self.reload_thread.start()
+		return True
+
+	def scoreBatch(self, requests):
+		"""
+		Scores a batch of (query, k, model) requests, grouped by model. If
+		a model fails, the exception is the result of its requests only
+		"""
+
+		state = self.state
+		results = [None] * len(requests)
+		models = {}
+		for request_index, (query, k, model) in enumerate(requests):
+			models.setdefault(model, []).append(request_index)
+		for model, request_indices in models.items():
+			try:
+				doc_IDs_ordered = state.searchBatch([requests[i][0] for i in request_indices],
+					[requests[i][1] for i in request_indices], model)
+			except Exception as error:
+				doc_IDs_ordered = [error] * len(request_indices)
+			for request_index, doc_IDs in zip(request_indices, doc_IDs_ordered):
+				results[request_index] = doc_IDs
+		return results
+
+	async def handle(self, reader, writer):
+		"""
+		Answers one HTTP request, then closes the connection
+		"""
+
+		try:
+			request_line = (await reader.readline()).decode("latin-1").split()
+			while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+				pass # headers
+			if len(request_line) < 2 or request_line[0] not in ("GET", "POST"):
+				return await self.reply(writer, 405, {"error" : "only GET and POST are supported"})
+
+			url = urlparse(request_line[1])
+			if url.path == "/reload":
+				if self.reload():
+					await self.reply(writer, 202, {"status" : "reloading"})
+				else:
+					await self.reply(writer, 409, {"status" : "a reload is already running"})
+			elif request_line[0] != "GET":
+				await self.reply(writer, 404, {"error" : "unknown path " + url.path})
+			elif url.path == "/search":
+				await self.search(writer, parse_qs(url.query))
+			elif url.path == "/health":
+				state = self.state
+				await self.reply(writer, 200, {
+					"status" : "ok",
+					"num_docs" : len(state.index["docIDs"]),
+					"loaded_at" : state.loaded_at,
+					"models_ready" : sorted(state.engines),
+					"reloading" : self.reload_thread is not None and self.reload_thread.is_alive(),
+					"last_reload_error" : self.reload_error
+				})
+			elif url.path == "/stats":
+				await self.reply(writer, 200, self.batcher.stats())
+			else:
+				await self.reply(writer, 404, {"error" : "unknown path " + url.path})
+		finally:
+			writer.close()
+
+	async def search(self, writer, params):
+		"""
+		Answers /search?q=...&k=...&model=...
+		"""
+
+		start = time.time()
+		try:
+			query, k, model = parseSearchParams(params)
+		except ValueError as error:
+			return await self.reply(writer, 400, {"error" : str(error)})
+
+		try:
+			doc_IDs = await self.batcher.submit((query, k, model))
+		except Exception as error:
+			return await self.reply(writer, 500, {"error" : str(error)})
+		await self.reply(writer, 200, {
+			"query" : query,
+			"model" : model,
+			"k" : k,
+			"results" : doc_IDs,
+			"took_ms" : round(1000 * (time.time() - start), 3)
+		})
+
+	async def reply(self, writer, code, body):
+		"""
+		Sends a JSON response
+		"""
+
+		reasons = {200 : "OK", 202 : "Accepted", 400 : "Bad Request", 404 : "Not Found",
+			405 : "Method Not Allowed", 409 : "Conflict", 500 : "Internal Server Error"}
+		data = json.dumps(body).encode("utf-8")
+		writer.write(("HTTP/1.1 " + str(code) + " " + reasons[code] + "\r\n" +
+			"Content-Type: application/json\r\n" +
+			"Content-Length: " + str(len(data)) + "\r\n" +
+			"Connection: close\r\n\r\n").encode("latin-1") + data)
+		await writer.drain()
+
+	async def serve(self):
+		"""
+		Serves requests until cancelled
+		"""
+
+		self.batcher.start()
+		server = await asyncio.start_server(self.handle, self.host, self.port)
+		async with server:
+			await server.serve_forever()
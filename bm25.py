@@ -0,0 +1,72 @@
+import numpy as np
+from scipy import sparse
+
+class BM25():
+
+	def __init__(self, k1=1.2, b=0.75, delta=0.0):
+		"""
+		Parameters
+		----------
+		arg1 : float
+			Term frequency saturation
+		arg2 : float
+			Strength of the document length normalization, between 0 and 1
+		arg3 : float
+			Lower bound added to the score of every matched term (BM25+),
+			0 gives plain BM25
+		"""
+		self.k1 = k1
+		self.b = b
+		self.delta = delta
+		self.impacts = None
+
+	def buildImpacts(self, tf):
+		"""
+		Precomputes the BM25 score of every (doc, term) posting
+
+		Parameters
+		----------
+		arg1 : sparse matrix
+			The (docs x terms) term counts of the collection
+		Returns
+		-------
+		None
+		"""
+
+		tf = sparse.csc_matrix(tf, dtype=np.float64)
+		num_docs = tf.shape[0]
+
+		# document lengths (in terms, without the '.' tokens)
+		doc_lengths = np.asarray(tf.sum(axis=1)).ravel()
+		avg_length = doc_lengths.mean() if num_docs > 0 else 0
+		if avg_length == 0:
+			avg_length = 1
+
+		# idf - the non-negative variant, log(1 + (N - df + 0.5)/(df + 0.5))
+		df = np.diff(tf.indptr)
+		idf = np.log(1 + (num_docs - df + 0.5)/(df + 0.5))
+
+		# impact of each posting
+		counts = tf.data
+		norms = self.k1 * (1 - self.b + self.b * doc_lengths[tf.indices] / avg_length)
+		term_idf = np.repeat(idf, df)
+		data = term_idf * (counts * (self.k1 + 1) / (counts + norms) + self.delta)
+
+		self.impacts = sparse.csc_matrix((data, tf.indices, tf.indptr), shape=tf.shape).tocsr()
+
+	def scores(self, query_counts):
+		"""
+		BM25 scores of a batch of queries with all the documents,
+		computed from the postings of the query terms only
+
+		Parameters
+		----------
+		arg1 : sparse matrix
+			The (queries x terms) term counts of the queries
+		Returns
+		-------
+		array
+			A (queries x docs) array of scores
+		"""
+
+		return np.asarray(query_counts.dot(self.impacts.T).toarray())
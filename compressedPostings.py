@@ -0,0 +1,249 @@
+import bisect
+from itertools import accumulate
+
+import numpy as np
+
+# Number of postings per block, each block can be decoded on its own
+BLOCK_SIZE = 128
+
+# Maps a byte to its 7 value bits
+LOW_BITS = bytes(bytearray(byte & 127 for byte in range(256)))
+
+class CompressedPostings():
+
+	def __init__(self, data, block_offsets, block_last_docs, term_blocks):
+		"""
+		Posting lists compressed with delta + variable-byte encoding
+
+		The postings of each term are cut into blocks of BLOCK_SIZE. A block
+		holds the gaps between consecutive doc indices (the first one relative
+		to the last doc of the previous block of the term), followed by the
+		term counts, all variable-byte encoded: 7 bits per byte, the high bit
+		set on the last byte of each value. The last doc of every block is
+		kept uncompressed as a skip pointer
+
+		Use encode to build it from uncompressed postings
+
+		Parameters
+		----------
+		arg1 : array
+			The encoded bytes of all the blocks (uint8)
+		arg2 : array
+			The offset of each block in data, plus the end of data (int64)
+		arg3 : array
+			The last doc index of each block (int32)
+		arg4 : array
+			The first block of each term, plus the number of blocks (int64)
+		"""
+
+		self.data = data
+		self.block_offsets = block_offsets
+		self.block_last_docs = block_last_docs
+		self.term_blocks = term_blocks
+
+	@classmethod
+	def encode(cls, ptr, docs, tfs):
+		"""
+		Compresses postings given as parallel arrays, see util.Postings
+
+		Parameters
+		----------
+		arg1 : array
+			The offsets of the postings of each term
+		arg2 : array
+			The doc indices, increasing within each term
+		arg3 : array
+			The term counts
+		Returns
+		-------
+		CompressedPostings
+		"""
+
+		ptr = np.asarray(ptr, dtype=np.int64)
+		docs = np.asarray(docs, dtype=np.int64)
+		tfs = np.asarray(tfs, dtype=np.int64)
+
+		# blocks - BLOCK_SIZE postings, never spanning two terms
+		lengths = np.diff(ptr)
+		blocks_per_term = (lengths + BLOCK_SIZE - 1) // BLOCK_SIZE
+		term_blocks = np.concatenate([[0], np.cumsum(blocks_per_term)]).astype(np.int64)
+		block_terms = np.repeat(np.arange(len(lengths)), blocks_per_term)
+		block_starts = ptr[block_terms] + (np.arange(len(block_terms)) - term_blocks[block_terms]) * BLOCK_SIZE
+		block_ends = np.minimum(block_starts + BLOCK_SIZE, ptr[block_terms + 1])
+
+		# gaps - each doc minus the previous doc of the same term (minus 0 for the first)
+		gaps = docs.copy()
+		within_term = np.ones(len(docs), dtype=bool)
+		within_term[ptr[:-1][lengths > 0]] = False
+		gaps[within_term] = docs[within_term] - docs[np.nonzero(within_term)[0] - 1]
+
+		# per block - the gaps, then the tfs
+		block_of_posting = np.repeat(np.arange(len(block_terms)), block_ends - block_starts)
+		postings = np.arange(len(docs))
+		values = np.empty(2 * len(docs), dtype=np.int64)
+		values[block_starts[block_of_posting] + postings] = gaps
+		values[block_ends[block_of_posting] + postings] = tfs
+
+		data, value_sizes = cls.encodeVByte(values)
+
+		# byte offset of each block
+		value_bytes = np.concatenate([[0], np.cumsum(value_sizes)])
+		block_value_starts = 2 * block_starts
+		block_offsets = np.concatenate([value_bytes[block_value_starts], [len(data)]]).astype(np.int64)
+		block_last_docs = docs[block_ends - 1].astype(np.int32) if len(block_ends) else np.zeros(0, dtype=np.int32)
+
+		return cls(data, block_offsets, block_last_docs, term_blocks)
+
+	@staticmethod
+	def encodeVByte(values):
+		"""
+		Variable-byte encoding of non-negative integers, vectorized
+
+		Returns
+		-------
+		array, array
+			The encoded bytes (uint8) and the number of bytes of each value
+		"""
+
+		values = np.asarray(values, dtype=np.int64)
+		sizes = np.ones(len(values), dtype=np.int64)
+		remaining = values >> 7
+		while np.any(remaining):
+			sizes += remaining > 0
+			remaining = remaining >> 7
+
+		starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+		data = np.zeros(int(sizes.sum()), dtype=np.uint8)
+		for byte in range(int(sizes.max()) if len(sizes) else 0):
+			has_byte = sizes > byte
+			data[starts[has_byte] + byte] = (values[has_byte] >> (7 * byte)) & 127
+		data[starts + sizes - 1] |= 128 # end of value
+
+		return data, sizes
+
+	def decodeBlock(self, block, base=0):
+		"""
+		The doc indices and term counts of a block, as lists. base is the
+		last doc of the previous block of the same term, 0 for a first block
+		"""
+
+		raw = self.data[self.block_offsets[block]:self.block_offsets[block + 1]].tobytes()
+		if min(raw) >= 128:
+			# every value fits in a byte (the common case: small gaps and
+			# counts), only the end-of-value bits are cleared
+			values = list(raw.translate(LOW_BITS))
+		else:
+			# a block is at most 2 * BLOCK_SIZE values, decoded faster in
+			# pure Python than through numpy
+			values, value, shift = [], 0, 0
+			for byte in raw:
+				if byte & 128:
+					values.append(value | (byte & 127) << shift)
+					value, shift = 0, 0
+				else:
+					value |= byte << shift
+					shift += 7
+		count = len(values) // 2
+		gaps = values[:count]
+		gaps[0] += base
+		return list(accumulate(gaps)), values[count:]
+
+	def nbytes(self):
+		"""
+		Size of the compressed postings, skip pointers included
+		"""
+		return self.data.nbytes + self.block_offsets.nbytes + \
+			self.block_last_docs.nbytes + self.term_blocks.nbytes
+
+	def cursor(self, term, query_weight, term_scale, doc_scales, upper_bound):
+		"""
+		A cursor over the postings of a term, see CompressedPostingCursor
+		"""
+		return CompressedPostingCursor(self, term, query_weight, term_scale, doc_scales, upper_bound)
+
+
+class CompressedPostingCursor():
+
+	def __init__(self, postings, term, query_weight, term_scale, doc_scales, upper_bound):
+		"""
+		A cursor over the compressed postings of a single query term, that
+		decodes one block at a time and uses the skip pointers to jump over
+		blocks. It has the interface of maxScore.PostingCursor
+
+		Parameters
+		----------
+		arg1 : CompressedPostings
+			The compressed postings
+		arg2 : int
+			The term id
+		arg3 : float
+			The weight of the term in the query
+		arg4 : float
+			A factor applied to the term counts (the idf of the term)
+		arg5 : list
+			A factor per doc, applied to the term counts (1/doc norm)
+		arg6 : float
+			The largest weight of the term in any doc
+		"""
+
+		self.postings = postings
+		self.query_weight = query_weight * term_scale
+		self.doc_scales = doc_scales
+		self.upper_bound = query_weight * upper_bound # max score contribution
+
+		self.first_block = int(postings.term_blocks[term])
+		self.end_block = int(postings.term_blocks[term + 1])
+		self.last_docs = postings.block_last_docs[self.first_block:self.end_block].tolist()
+		self.block = self.first_block - 1
+		self.docs, self.tfs, self.position = [], [], 0
+		self.loadBlock(self.first_block)
+
+	def loadBlock(self, block):
+		"""
+		Decode a block and move to its first posting
+		"""
+		if block != self.block:
+			self.block = block
+			if block < self.end_block:
+				# the first gap of a block is relative to the last doc of the previous one
+				base = self.last_docs[block - self.first_block - 1] if block > self.first_block else 0
+				self.docs, self.tfs = self.postings.decodeBlock(block, base)
+			else:
+				self.docs, self.tfs = [], []
+		self.position = 0
+
+	def doc(self):
+		"""
+		The current doc index, None once the postings are exhausted
+		"""
+		if self.position < len(self.docs):
+			return self.docs[self.position]
+		return None
+
+	def score(self):
+		"""
+		The score contribution of the term to the current doc
+		"""
+		doc = self.docs[self.position]
+		return self.query_weight * self.tfs[self.position] * self.doc_scales[doc]
+
+	def next(self):
+		"""
+		Move to the next posting
+		"""
+		self.position += 1
+		if self.position == len(self.docs) and self.block < self.end_block:
+			self.loadBlock(self.block + 1)
+
+	def nextGEQ(self, doc):
+		"""
+		Move to the first posting with a doc index >= doc, skipping
+		the blocks whose last doc is smaller
+		"""
+		current = self.doc()
+		if current is None or current >= doc:
+			return
+		block = self.first_block + bisect.bisect_left(self.last_docs, doc, self.block - self.first_block)
+		if block != self.block:
+			self.loadBlock(block)
+		self.position = bisect.bisect_left(self.docs, doc, self.position)
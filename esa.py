@@ -3,6 +3,7 @@ from util import Utilities
 import wikipedia
 import json
 import numpy as np
+from scipy import sparse
 
 # Parser warning might occur :
 # The code that caused this warning is on line 389 of the file /anaconda3/lib/python3.8/site-packages/wikipedia/wikipedia.py.
@@ -56,65 +57,111 @@ class ESA():
 	# 	with open("wikipedia_concepts_whole_content.json", 'w') as fout: # for the whole content
 	# 		json.dump(pages, fout)
 
-	def buildConceptsIndex(self, concepts):
+	def buildConceptsIndex(self, concepts, top_n=None):
 		"""
 		Builds the concept index and stores it in the 'index' class variable
 
+		The concepts x terms tfidf matrix is sparse and built in a single pass
+		over the concepts. The tf of a term in a concept is the number of
+		sentences of the concept that contain it.
+
 		Parameters
 		----------
 		arg1 : list
 			A list of lists of lists where each sub-list is
 			the content of a concept(wikipedia article) and each sub-sub-list is a sentence
 			of the content of that concept
+		arg2 : int
+			If given, only the top_n strongest concepts of each term are kept
+			(the pruning of classic ESA), None keeps all of them
 		Returns
 		-------
 		None
 		"""
 
 		index = None
-		#Fill in code here
 
-		concept_inv_index = self.utilities.concepts_inverted_index(concepts)
 		corpus = self.utilities.corpus
+		term_index = {word: word_index for word_index, word in enumerate(corpus)}
 
-		# idf
-		idf = {}
-		for word in corpus:
-			if word not in concept_inv_index:
-				idf[word] = 0
-			else:
-				idf[word] = np.log10(len(concepts)/(len(concept_inv_index[word])))
+		# tf - one pass over the concepts
+		rows, cols, counts = [], [], []
+		num_concepts = 0
+		for concept_index, concept in enumerate(concepts):
+			concept_counts = {}
+			for sentence in concept:
+				for word in set(sentence):
+					if word in term_index:
+						word_index = term_index[word]
+						concept_counts[word_index] = concept_counts.get(word_index, 0) + 1
+			rows.extend([concept_index] * len(concept_counts))
+			cols.extend(concept_counts.keys())
+			counts.extend(concept_counts.values())
+			num_concepts += 1
+		rows = np.array(rows, dtype=np.int32)
+		cols = np.array(cols, dtype=np.int32)
+		counts = np.array(counts, dtype=np.float64)
+
+		# idf - 0 for the terms that appear in no concept
+		df = np.bincount(cols, minlength=len(corpus))
+		idf = np.zeros(len(corpus))
+		idf[df > 0] = np.log10(num_concepts/df[df > 0])
 
 		# tfidf
-		tfidf = np.zeros([len(concepts),len(corpus)])
-		concept_index = 0
-		for concept in concepts:
-			for sentence in concept:
-				words = list(set.intersection(set(corpus), set(sentence)))
-				for word in words:
-					word_index = corpus.index(word)
-					tfidf[concept_index][word_index] += idf[word] # multiple adds -> covers tf
-			concept_index += 1
+		tfidf = sparse.csr_matrix((counts * idf[cols], (rows, cols)),
+			shape=(num_concepts, len(corpus)))
+		tfidf.eliminate_zeros()
+
+		if top_n is not None:
+			tfidf = self.pruneConcepts(tfidf, top_n)
 
 		index = {
-			"concept_inv_index" : concept_inv_index,
 			"concept_corpus" : corpus,
 			"concepts_tfidf" : tfidf
 		}
 
 		ESA.index = index
 
+	def pruneConcepts(self, tfidf, top_n):
+		"""
+		Keeps the top_n largest weights of each term (column)
+
+		Parameters
+		----------
+		arg1 : sparse matrix
+			The concepts x terms tfidf matrix
+		arg2 : int
+			The number of concepts to keep per term
+		Returns
+		-------
+			The pruned concepts x terms tfidf matrix (CSR)
+		"""
+
+		tfidf = sparse.csc_matrix(tfidf)
+		tfidf.sort_indices()
+		column = np.repeat(np.arange(tfidf.shape[1]), np.diff(tfidf.indptr))
+
+		# entries sorted by column, then by decreasing weight
+		order = np.lexsort((-tfidf.data, column))
+		rank_in_column = np.arange(len(order)) - tfidf.indptr[column[order]]
+		keep = order[rank_in_column < top_n]
+
+		pruned = sparse.csc_matrix((tfidf.data[keep], (tfidf.indices[keep], column[keep])),
+			shape=tfidf.shape)
+		return pruned.tocsr()
+
 	def map_docs_to_concept_space(self, docs_tfidf):
 		"""
 		Parameters
 		----------
 		arg1 : matrix
 			The tfidf matrix of all the docs with all the terms in the corpus
+			(a dense array or a scipy sparse matrix)
 		Returns
 		-------
 			The docs mapped to the concept space
 		"""
-		docs_concepts = np.matmul(docs_tfidf, np.transpose(ESA.index["concepts_tfidf"]))
+		docs_concepts = ESA.index["concepts_tfidf"].dot(docs_tfidf.T).T
 		return docs_concepts
 
 	def map_query_to_concept_space(self, query_tfidf):
@@ -123,9 +170,10 @@ class ESA():
 		----------
 		arg1 : A vector
 			The tfidf vector of a query with all the terms in the corpus
+			(or a queries x terms matrix, dense or sparse, for a batch of queries)
 		Returns
 		-------
 			The query mapped to the concept space
 		"""
-		query_concepts = np.matmul(query_tfidf, np.transpose(ESA.index["concepts_tfidf"]))
+		query_concepts = ESA.index["concepts_tfidf"].dot(query_tfidf.T).T
 		return query_concepts
@@ -395,3 +395,134 @@ class Evaluation():
 		meanAveragePrecision = sumAveragePrecision/(len(query_ids))
 
 		return meanAveragePrecision
+
+
+	def meanMetrics(self, doc_IDs_ordered, query_ids, qrels, max_k):
+		"""
+		Computation of precision, recall, fscore, MAP and nDCG of the
+		Information Retrieval System at every k from 1 to max_k, averaged
+		over all the queries, with the same values as the mean* methods
+
+		The top max_k documents of each query are turned into rows of
+		relevance matrices (binary, and graded by the qrel "position"), and
+		each metric is computed for all the k at once from cumulative sums
+		along the ranks
+
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of integers where the ith sub-list is a list of IDs
+			of documents in their predicted order of relevance to the ith query
+		arg2 : list
+			A list of IDs of the queries for which the documents are ordered
+		arg3 : list or Qrels
+			A list of dictionaries containing document-relevance
+			judgements - Refer cran_qrels.json for the structure of each
+			dictionary - or the Qrels built from it once
+		arg4 : int
+			The largest k value
+
+		Returns
+		-------
+		dict
+			For each of "precision", "recall", "fscore", "MAP" and "nDCG",
+			an array of max_k values - the value at k is at index k-1
+		"""
+
+		if not isinstance(qrels, Qrels):
+			qrels = Qrels(qrels)
+
+		num_queries = len(query_ids)
+		binary = np.zeros((num_queries, max_k)) # 1 where the doc at that rank is relevant
+		recall_gains = np.zeros((num_queries, max_k)) # number of qrels of the doc, at its first rank
+		graded = np.zeros((num_queries, max_k)) # relevance of the doc at that rank
+		ideal = np.zeros((num_queries, max_k)) # relevances of the retrieved relevant docs, best first
+		num_true = np.zeros(num_queries)
+
+		for row, query_id in enumerate(query_ids):
+			true_doc_IDs, counts, relevances = qrels.judgements(query_id)
+			ranked = np.asarray(doc_IDs_ordered[query_id - 1], dtype=np.int64)
+			num_true[row] = counts.sum()
+			if len(true_doc_IDs) == 0 or len(ranked) == 0:
+				continue
+
+			positions = np.minimum(np.searchsorted(true_doc_IDs, ranked), len(true_doc_IDs) - 1)
+			found = true_doc_IDs[positions] == ranked
+			first = np.zeros(len(ranked), dtype=bool)
+			first[np.unique(ranked, return_index=True)[1]] = True
+
+			top = min(max_k, len(ranked))
+			binary[row, :top] = found[:top]
+			recall_gains[row, :top] = np.where(found[:top] & first[:top], counts[positions[:top]], 0)
+			graded[row, :top] = np.where(found[:top], relevances[positions[:top]], 0)
+			# the ideal ordering is taken over the relevant docs of the whole ranking
+			best = np.sort(relevances[positions[found]])[::-1][:max_k]
+			ideal[row, :len(best)] = best
+
+		ks = np.arange(1, max_k + 1)
+		discounts = np.log2(np.arange(max_k) + 2)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			hits = np.cumsum(binary, axis=1)
+			precision = hits / ks
+			recall = np.cumsum(recall_gains, axis=1) / num_true[:, None]
+			recall[num_true == 0] = 0
+			fscore = np.where(precision + recall > 0, (2 * precision * recall) / (precision + recall), 0)
+			# sum of precision@i over the ranks i of relevant docs, averaged over those docs
+			averagePrecision = np.where(hits > 0, np.cumsum(binary * precision, axis=1) / hits, 0)
+			DCG = np.cumsum(graded / discounts, axis=1)
+			IDCG = np.cumsum(ideal / discounts, axis=1)
+			nDCG = np.where(IDCG != 0, DCG / IDCG, 0)
+
+		# the queries are summed in order, as by the mean* methods
+		metrics = {"precision" : precision, "recall" : recall, "fscore" : fscore,
+			"MAP" : averagePrecision, "nDCG" : nDCG}
+		return dict((name, np.cumsum(values, axis=0)[-1] / num_queries) for name, values in metrics.items())
+
+
+class Qrels():
+
+	def __init__(self, qrels):
+		"""
+		Relevance judgements grouped by query once, so that evaluating a
+		query does not scan all the judgements again
+
+		Parameters
+		----------
+		arg1 : list
+			A list of dictionaries containing document-relevance
+			judgements - Refer cran_qrels.json for the structure of each
+			dictionary
+		"""
+
+		grouped = {}
+		for qrel in qrels:
+			doc_IDs, relevances = grouped.setdefault(qrel["query_num"], ([], []))
+			doc_IDs.append(int(qrel["id"]))
+			relevances.append(qrel["position"])
+
+		self.queries = {}
+		for query_num, (doc_IDs, relevances) in grouped.items():
+			doc_IDs = np.array(doc_IDs, dtype=np.int64)
+			# a doc judged more than once counts once per judgement for recall,
+			# and with the relevance of its first judgement for nDCG
+			true_doc_IDs, first, counts = np.unique(doc_IDs, return_index=True, return_counts=True)
+			self.queries[query_num] = (true_doc_IDs, counts, np.array(relevances)[first])
+
+	def judgements(self, query_id):
+		"""
+		The judgements of a query
+
+		Parameters
+		----------
+		arg1 : int
+			The ID of the query
+
+		Returns
+		-------
+		array, array, array
+			The sorted IDs of the relevant documents, the number of
+			judgements of each and the relevance of its first judgement
+		"""
+
+		empty = np.zeros(0, dtype=np.int64)
+		return self.queries.get(str(query_id), (empty, empty, empty))
@@ -0,0 +1,145 @@
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+# Bumped whenever the layout of the index folder changes
+INDEX_VERSION = 2
+
+class IndexStorage():
+
+	def save(self, index, index_dir, params=None):
+		"""
+		Writes an index built by InformationRetrieval to a folder
+
+		- vocabulary.json and doc_ids.json hold the terms and the doc-ID map
+		- idf.npy holds the idf of each term, in vocabulary order
+		- every other entry of the index is written as .npy files
+		  (data, indices and indptr for the sparse matrices)
+		- meta.json holds the format version, the preprocessing parameters
+		  and the list of entries, and is written last
+
+		Parameters
+		----------
+		arg1 : dict
+			The index, as stored in InformationRetrieval.index
+		arg2 : str
+			Path to the index folder
+		arg3 : dict
+			The preprocessing parameters the index was built with
+		Returns
+		-------
+		None
+		"""
+
+		if not os.path.isdir(index_dir):
+			os.makedirs(index_dir)
+		# the folder holds no valid index until meta.json is rewritten
+		meta_path = os.path.join(index_dir, "meta.json")
+		if os.path.isfile(meta_path):
+			os.remove(meta_path)
+
+		corpus = index["corpus"]
+		self.writeJSON(index_dir, "vocabulary.json", corpus)
+		self.writeJSON(index_dir, "doc_ids.json", index["docIDs"])
+		idf = np.array([index["idf"][word] for word in corpus], dtype=np.float64)
+		self.writeArray(index_dir, "idf", idf)
+
+		entries = {}
+		for key, value in index.items():
+			if key in ("corpus", "term_index", "idf", "docIDs"):
+				continue
+			if sparse.issparse(value):
+				for part in ("data", "indices", "indptr"):
+					self.writeArray(index_dir, key + "_" + part, getattr(value, part))
+				entries[key] = {"format" : value.format, "shape" : list(value.shape)}
+			else:
+				self.writeArray(index_dir, key, np.asarray(value))
+				entries[key] = {"format" : "array"}
+
+		meta = {
+			"version" : INDEX_VERSION,
+			"params" : params or {},
+			"num_docs" : len(index["docIDs"]),
+			"num_terms" : len(corpus),
+			"entries" : entries
+		}
+		self.writeJSON(index_dir, "meta.json", meta)
+
+	def load(self, index_dir, params=None):
+		"""
+		Loads an index written by save. The numeric arrays are
+		memory-mapped instead of being read into memory
+
+		Parameters
+		----------
+		arg1 : str
+			Path to the index folder
+		arg2 : dict
+			The preprocessing parameters the index must have been built with,
+			None to accept any
+		Returns
+		-------
+		dict
+			The index, or None if there is no index of the current version
+			with the same parameters in the folder
+		"""
+
+		meta_path = os.path.join(index_dir, "meta.json")
+		if not os.path.isfile(meta_path):
+			return None
+		meta = json.load(open(meta_path, 'r'))
+		if meta["version"] != INDEX_VERSION:
+			return None
+		if params is not None and meta["params"] != params:
+			return None
+
+		corpus = json.load(open(os.path.join(index_dir, "vocabulary.json"), 'r'))
+		idf = self.readArray(index_dir, "idf")
+		index = {
+			"corpus" : corpus,
+			"term_index" : {word: word_index for word_index, word in enumerate(corpus)},
+			"idf" : dict(zip(corpus, idf.tolist())),
+			"docIDs" : json.load(open(os.path.join(index_dir, "doc_ids.json"), 'r'))
+		}
+
+		for key, entry in meta["entries"].items():
+			if entry["format"] == "array":
+				index[key] = self.readArray(index_dir, key)
+				continue
+			data, indices, indptr = [self.readArray(index_dir, key + "_" + part)
+				for part in ("data", "indices", "indptr")]
+			matrix_type = sparse.csr_matrix if entry["format"] == "csr" else sparse.csc_matrix
+			index[key] = matrix_type((data, indices, indptr),
+				shape=tuple(entry["shape"]), copy=False)
+
+		return index
+
+	def writeArray(self, index_dir, name, array):
+		"""
+		Writes an array to name.npy, through a temporary file so that
+		a memory-mapped copy of the previous version stays valid
+		"""
+
+		path = os.path.join(index_dir, name + ".npy")
+		with open(path + ".tmp", 'wb') as fout:
+			np.save(fout, array)
+		os.replace(path + ".tmp", path)
+
+	def readArray(self, index_dir, name):
+		"""
+		Memory-maps name.npy (read-only)
+		"""
+
+		return np.load(os.path.join(index_dir, name + ".npy"), mmap_mode='r')
+
+	def writeJSON(self, index_dir, name, value):
+		"""
+		Writes a JSON file through a temporary file
+		"""
+
+		path = os.path.join(index_dir, name)
+		with open(path + ".tmp", 'w') as fout:
+			json.dump(value, fout)
+		os.replace(path + ".tmp", path)
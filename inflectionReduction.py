@@ -1,7 +1,19 @@
 from nltk.stem import PorterStemmer
+from functools import lru_cache
 
 class InflectionReduction:
 
+	def __init__(self, cacheSize=65536):
+		"""
+		Parameters
+		----------
+		arg1 : int
+			Maximum number of token -> stem mappings kept in the LRU memo cache,
+			0 disables the cache and None leaves it unbounded
+		"""
+		self.stemmer = PorterStemmer()
+		self.stem = lru_cache(maxsize=cacheSize)(self.stemmer.stem)
+
 	def reduce(self, text):
 		"""
 		Stemming/Lemmatization
@@ -25,7 +37,28 @@ class InflectionReduction:
 		for s in text:
 			words = []
 			for word in s:
-				words.append(PorterStemmer().stem(word))
+				words.append(self.stem(word))
 			reducedText.append(words)
 
 		return reducedText
+
+	def cacheInfo(self):
+		"""
+		Statistics of the stemming memo cache
+
+		Returns
+		-------
+		dict
+			The number of hits and misses, the hit rate (between 0 and 1),
+			and the current and maximum number of cached stems
+		"""
+
+		info = self.stem.cache_info()
+		lookups = info.hits + info.misses
+		return {
+			"hits" : info.hits,
+			"misses" : info.misses,
+			"hit_rate" : info.hits/lookups if lookups > 0 else 0,
+			"size" : info.currsize,
+			"max_size" : info.maxsize
+		}
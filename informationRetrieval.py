@@ -1,8 +1,14 @@
 from util import Utilities
 
 import numpy as np
+from scipy import sparse
+import scipy.sparse.linalg
 from lsa import LSA
 from esa import ESA
+from indexStorage import IndexStorage
+from maxScore import MaxScore
+from compressedPostings import CompressedPostings
+from bm25 import BM25
 
 class InformationRetrieval():
 
@@ -12,21 +18,28 @@ class InformationRetrieval():
 		self.lsa = LSA()
 		self.esa = ESA()
 		self.utilities = Utilities()
+		self.storage = IndexStorage()
+		self.maxScore = None
+		self.bm25 = None
 
-	def buildIndex(self, docs, docIDs, isLSA):
+	def buildIndex(self, docs, docIDs, isLSA, indexer=None):
 		"""
 		Builds the document index in terms of the document
 		IDs and stores it in the 'index' class variable
 
 		Parameters
 		----------
-		arg1 : list
-			A list of lists of lists where each sub-list is
-			a document and each sub-sub-list is a sentence of the document
+		arg1 : iterable
+			A list (or a stream) of lists of lists where each sub-list is
+			a document and each sub-sub-list is a sentence of the document.
+			It is iterated only once
 		arg2 : list
 			A list of integers denoting IDs of the documents
 		arg3: boolean
 			Says whether LSA is being performed or not
+		arg4 : object
+			Builds the postings with its inverted_index method, such as
+			SPIMIIndexer (default: Utilities, in memory)
 		Returns
 		-------
 		None
@@ -34,44 +47,319 @@ class InformationRetrieval():
 
 		index = None
 
-		inv_index, corpus = self.utilities.inverted_index(docs)
+		if indexer is None:
+			indexer = self.utilities
+		postings, corpus = indexer.inverted_index(docs)
+		num_docs = len(docIDs)
+
+		# term -> column of the tfidf matrix
+		term_index = {word: word_index for word_index, word in enumerate(corpus)}
 
 		# idf
-		idf = {}
-		for word in corpus:
-			idf[word] = np.log10(len(docs)/(len(inv_index[word])))
-
-		# tfidf
-		tfidf = np.zeros([len(docs),len(corpus)])
-		doc_index = 0
-		for doc in docs:
-			for sentence in doc:
-				for word in sentence:
-					if word in corpus:
-						word_index = corpus.index(word)
-						tfidf[doc_index][word_index] += idf[word] # multiple adds -> covers tf
-			doc_index += 1
+		idf_values = np.log10(num_docs/postings.df())
+		idf = dict(zip(corpus, idf_values.tolist()))
+
+		# postings - sparse (docs x terms) term counts, the postings arrays are its columns
+		tf = sparse.csc_matrix((postings.tfs, postings.docs, postings.ptr),
+			shape=(num_docs, len(corpus)))
+
+		# tfidf - tf * idf on the same sparsity structure, stored row-wise for ranking
+		data = tf.data * np.repeat(idf_values, postings.df())
+		tfidf = sparse.csc_matrix((data, postings.docs, postings.ptr),
+			shape=(num_docs, len(corpus))).tocsr()
+
+		# document norms, computed once so that ranking does not redo them per query
+		doc_norms = sparse.linalg.norm(tfidf, axis=1)
+
+		index = {
+			"corpus" : corpus,
+			"term_index" : term_index,
+			"idf" : idf,
+			"docIDs" : list(docIDs),
+			"tf" : tf,
+			"tfidf" : tfidf,
+			"doc_norms" : doc_norms
+		}
+
+		self.index = index
+		self.maxScore = None
+		self.bm25 = None
 
 		if(isLSA == True):
-			tfidf_k, u_k, s_values_k, vt_k = self.lsa.reduced_tfidf(tfidf)
-			index = {
-				"corpus" : corpus,
-				"idf" : idf,
-				"tfidf" : tfidf_k,
-				"T": u_k, # txs
-				"S": s_values_k, # sxs
-				"D": np.transpose(vt_k) # dxs
+			self.buildLSA()
+
+	def buildLSA(self, k=300, isRandomized=True):
+		"""
+		Adds the LSA factors of the tfidf matrix to the current index
+
+		Parameters
+		----------
+		arg1 : int
+			The number of dimensions to keep
+		arg2 : boolean
+			Says whether to use the randomized SVD, or the exact truncated one
+		Returns
+		-------
+		None
+		"""
+
+		u_k, s_k, vt_k = self.lsa.reduced_tfidf(self.index["tfidf"], k, isRandomized)
+		self.index["T"] = u_k # txs
+		self.index["S"] = s_k # s
+		self.index["D"] = np.transpose(vt_k) # dxs
+		# normalized doc embeddings, so that scoring is a single product
+		self.index["lsa_docs"] = self.lsa.doc_embeddings(s_k, self.index["D"]) # dxs
+
+	def hasLSA(self, k=300):
+		"""
+		Says whether the current index holds LSA factors of k dimensions
+		(fewer if the tfidf matrix is smaller)
+		"""
+
+		if "lsa_docs" not in self.index:
+			return False
+		dims = len(self.index["S"])
+		return dims == k or (dims < k and dims >= min(self.index["tfidf"].shape) - 1)
+
+	def buildESA(self, top_n=None):
+		"""
+		Adds the ESA concept vectors of the docs to the current index,
+		ESA.buildConceptsIndex must have been called first. The doc vectors
+		are L2-normalized, and the concepts x terms matrix is kept with them
+		so that a loaded index can map queries to concept space
+
+		Parameters
+		----------
+		arg1 : int
+			The top_n the concept index was pruned with, None if not pruned
+		Returns
+		-------
+		None
+		"""
+
+		docs_concepts = sparse.csr_matrix(self.esa.map_docs_to_concept_space(self.index["tfidf"]))
+		norms = sparse.linalg.norm(docs_concepts, axis=1)
+		scale = np.zeros(len(norms))
+		scale[norms > 0] = 1/norms[norms > 0]
+
+		self.index["esa_concepts"] = ESA.index["concepts_tfidf"] # cxt
+		self.index["esa_docs"] = sparse.diags(scale).dot(docs_concepts).tocsr() # dxc
+		self.index["esa_doc_norms"] = (norms > 0).astype(np.float64) # 1, or 0 for empty docs
+		self.index["esa_top_n"] = np.array(top_n if top_n is not None else 0)
+
+	def hasESA(self, top_n=None):
+		"""
+		Says whether the current index holds ESA doc vectors built with top_n
+		"""
+
+		if "esa_docs" not in self.index:
+			return False
+		return int(self.index["esa_top_n"]) == (top_n if top_n is not None else 0)
+
+	def compressPostings(self):
+		"""
+		Adds delta + variable-byte compressed postings of the term counts
+		to the current index, see CompressedPostings. rankPruned then scores
+		from them instead of the uncompressed tfidf postings
+
+		Returns
+		-------
+		int, int
+			The size in bytes of the compressed postings and of the
+			uncompressed ones (doc indices, term counts and offsets)
+		"""
+
+		tf = sparse.csc_matrix(self.index["tf"])
+		compressed = CompressedPostings.encode(tf.indptr, tf.indices, tf.data)
+		# the upper bounds of MaxScore, computed from the uncompressed weights
+		uncompressed = {key: value for key, value in self.index.items() if not key.startswith("cpostings_")}
+		max_weights = MaxScore(uncompressed).max_weights
+
+		self.index["cpostings_data"] = compressed.data
+		self.index["cpostings_block_offsets"] = compressed.block_offsets
+		self.index["cpostings_block_last_docs"] = compressed.block_last_docs
+		self.index["cpostings_term_blocks"] = compressed.term_blocks
+		self.index["cpostings_max_weights"] = max_weights
+		self.maxScore = None
+
+		return compressed.nbytes(), tf.data.nbytes + tf.indices.nbytes + tf.indptr.nbytes
+
+	def hasCompressedPostings(self):
+		"""
+		Says whether the current index holds compressed postings
+		"""
+		return "cpostings_data" in self.index
+
+	def saveIndex(self, index_dir, params=None):
+		"""
+		Writes the current index to index_dir, see IndexStorage
+
+		Parameters
+		----------
+		arg1 : str
+			Path to the index folder
+		arg2 : dict
+			The preprocessing parameters the index was built with
+		Returns
+		-------
+		None
+		"""
+
+		self.storage.save(self.index, index_dir, params)
+
+	def loadIndex(self, index_dir, params=None):
+		"""
+		Loads an index written by saveIndex, with its arrays memory-mapped
+
+		Parameters
+		----------
+		arg1 : str
+			Path to the index folder
+		arg2 : dict
+			The preprocessing parameters the index must have been built with
+		Returns
+		-------
+		boolean
+			True if a compatible index was found and loaded
+		"""
+
+		index = self.storage.load(index_dir, params)
+		if index is None:
+			return False
+
+		self.useIndex(index)
+		return True
+
+	def useIndex(self, index):
+		"""
+		Makes an index built elsewhere (loaded, or shared by another
+		process) the current index
+
+		Parameters
+		----------
+		arg1 : dict
+			The index, as stored in InformationRetrieval.index
+		Returns
+		-------
+		None
+		"""
+
+		self.index = index
+		self.maxScore = None
+		self.bm25 = None
+		# the concept index is built over the vocabulary of the docs
+		Utilities.corpus = index["corpus"]
+		if "esa_concepts" in index:
+			ESA.index = {
+				"concept_corpus" : index["corpus"],
+				"concepts_tfidf" : index["esa_concepts"]
 			}
+
+	def queryVectors(self, queries, useIdf=True):
+		"""
+		Builds the tfidf vectors of the queries with all the terms in the corpus
+
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of lists where each sub-list is a query and
+			each sub-sub-list is a sentence of the query
+		arg2 : boolean
+			Says whether to weight the terms by idf, or to return raw term counts
+
+		Returns
+		-------
+		sparse matrix
+			A (queries x terms) CSR matrix with one tfidf vector per row
+		"""
+
+		term_index = self.index["term_index"]
+		idf = self.index["idf"]
+
+		rows, cols, data = [], [], []
+		for query_index, query in enumerate(queries):
+			for sentence in query:
+				for word in sentence:
+					word = word.lower()
+					if word != '.' and word in term_index:
+						rows.append(query_index)
+						cols.append(term_index[word])
+						data.append(idf[word] if useIdf else 1.0)
+
+		# duplicate (query, term) entries are summed -> covers tf
+		tfidf = sparse.coo_matrix((data, (rows, cols)),
+			shape=(len(queries), len(term_index)), dtype=np.float64)
+		return tfidf.tocsr()
+
+	def cosineSimilarities(self, query_vectors, doc_vectors, doc_norms):
+		"""
+		Cosine similarities of a batch of queries with all the documents,
+		computed with a single matrix product
+
+		Parameters
+		----------
+		arg1 : matrix
+			A (queries x dims) matrix, dense or sparse
+		arg2 : matrix
+			A (docs x dims) matrix, dense or sparse
+		arg3 : array
+			The precomputed norms of the rows of arg2
+
+		Returns
+		-------
+		array
+			A (queries x docs) array of cosine similarities
+		"""
+
+		dots = query_vectors.dot(doc_vectors.T)
+		if sparse.issparse(dots):
+			dots = dots.toarray()
+		dots = np.asarray(dots)
+
+		if sparse.issparse(query_vectors):
+			query_norms = sparse.linalg.norm(query_vectors, axis=1)
 		else:
-			index = {
-				"corpus" : corpus,
-				"idf" : idf,
-				"tfidf" : tfidf
-			}
+			query_norms = np.linalg.norm(query_vectors, axis=1)
 
-		self.index = index
+		with np.errstate(divide='ignore', invalid='ignore'):
+			cosine_sims = dots / np.outer(query_norms, doc_norms)
+		# 0 for empty docs, and for queries with no term in the corpus
+		cosine_sims[:, doc_norms == 0] = 0
+		cosine_sims[query_norms == 0, :] = 0
 
-	def rank(self, queries, isLSA, isESA):
+		return cosine_sims
+
+	def topK(self, cosine_sims, k=None):
+		"""
+		Indices of the k highest scores in decreasing order of score
+
+		Parameters
+		----------
+		arg1 : array
+			The scores of all the documents for a query
+		arg2 : int
+			The number of documents to return, None for a full ranking
+
+		Returns
+		-------
+		array
+			The indices of the top k documents, best first, ties by
+			decreasing index
+		"""
+
+		cosine_sims = np.asarray(cosine_sims)
+		if k is None or k >= len(cosine_sims):
+			# stable, so tied docs come in decreasing order of index
+			return np.argsort(cosine_sims, kind="stable")[::-1]
+
+		# every doc tied with the kth score is a candidate, then the candidates
+		# are sorted as in the full ranking, so the top k is a prefix of it
+		threshold = cosine_sims[np.argpartition(-cosine_sims, k - 1)[k - 1]]
+		candidates = np.nonzero(cosine_sims >= threshold)[0]
+		order = np.lexsort((-candidates, -cosine_sims[candidates]))
+		return candidates[order][:k]
+
+	def rank(self, queries, isLSA, isESA, k=None):
 		"""
 		Rank the documents according to relevance for each query
 
@@ -87,6 +375,10 @@ class InformationRetrieval():
 		arg3: boolean
 			Says whether ESA is being performed or not
 
+		arg4: int
+			The number of documents to return per query. None (the default)
+			returns the full ranking, as needed for evaluation
+
 		Returns
 		-------
 		list
@@ -95,60 +387,229 @@ class InformationRetrieval():
 		"""
 
 		doc_IDs_ordered = []
+		all_cosine_sims = self.similarities(queries, isLSA, isESA)
+
+		# ranking docs
+		docIDs = self.index["docIDs"]
+		for i in all_cosine_sims:
+			sorted_sim = self.topK(i, k)
+			doc_IDs_ordered.append([docIDs[j] for j in sorted_sim])
+
+		return doc_IDs_ordered
+
+	def similarities(self, queries, isLSA, isESA):
+		"""
+		Cosine similarities of a batch of queries with all the documents,
+		in the vector space of the model
+
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of lists where each sub-list is a query and
+			each sub-sub-list is a sentence of the query
+		arg2: boolean
+			Says whether LSA is being performed or not
+		arg3: boolean
+			Says whether ESA is being performed or not
+
+		Returns
+		-------
+		array
+			A (queries x docs) array of cosine similarities
+		"""
 
 		# class variables
-		corpus = self.index["corpus"]
-		idf = self.index["idf"]
 		tfidf_docs = self.index["tfidf"]
+		doc_norms = self.index["doc_norms"]
 
-		if(isESA == True):
-			docs_concepts = self.esa.map_docs_to_concept_space(tfidf_docs)
-			tfidf_docs = docs_concepts
+		# tfidf for all the queries at once
+		tfidf = self.queryVectors(queries)
 
-		tfidf = np.zeros([len(queries), len(corpus)])
-		query_index = 0
-		all_cosine_sims = []
+		# WITH LSA
+		if(isLSA == True):
+			T = self.index["T"] # txs
+			lsa_docs = self.index["lsa_docs"] # dxs
+			return self.lsa.cosine_similarity(T, lsa_docs, tfidf)
+		# WITH ESA
+		elif(isESA == True):
+			queries_concepts = self.esa.map_query_to_concept_space(tfidf)
+			return self.cosineSimilarities(queries_concepts,
+				self.index["esa_docs"], self.index["esa_doc_norms"])
+		# cosine similarities
+		else:
+			return self.cosineSimilarities(tfidf, tfidf_docs, doc_norms)
 
-		# ifidf for queries
-		for query in queries:
-			for sentence in query:
-				for word in sentence:
-					word = word.lower()
-					if word != '.' and word in corpus:
-						word_index = corpus.index(word)
-						tfidf[query_index][word_index] += idf[word] # multiple adds -> covers tf
-
-			query_tfidf = tfidf[query_index]
-
-			# WITH ESA
-			if(isESA == True):
-				query_tfidf = self.esa.map_query_to_concept_space(tfidf[query_index])
-
-			# WITHOUT LSA
-			# cosine similarities
-			if(isLSA == False):
-				cosine_sims = []
-				for tfidf_doc in tfidf_docs:
-					if np.linalg.norm(tfidf_doc) == 0:
-						cosine_sim = 0
-					else:
-						cosine_sim = np.dot(query_tfidf, tfidf_doc)/((np.linalg.norm(query_tfidf)) * (np.linalg.norm(tfidf_doc)))
-					cosine_sims.append(cosine_sim)
-				all_cosine_sims.append(cosine_sims)
-				query_index += 1
-			# WITH LSA
-			else:
-				T = self.index["T"] # txs
-				S = self.index["S"] # sxs
-				D = self.index["D"] # dxs
-				cosine_sims = self.lsa.cosine_similarity(T,S,D,query_tfidf)
-				all_cosine_sims.append(cosine_sims)
-				query_index += 1
+	def rankWithScores(self, queries, isLSA, isESA, isBM25, k=None):
+		"""
+		Rank the documents for each query as rank (or rankBM25) does, and
+		keep the score of each ranked document
 
-		# ranking docs
-		docIDs = [i+1 for i in range(len(tfidf_docs))]
-		for i in all_cosine_sims:
-			sorted_sim = np.argsort(i)[::-1]
-			doc_IDs_ordered.append([docIDs[j] for j in sorted_sim])
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of lists where each sub-list is a query and
+			each sub-sub-list is a sentence of the query
+		arg2: boolean
+			Says whether LSA is being performed or not
+		arg3: boolean
+			Says whether ESA is being performed or not
+		arg4: boolean
+			Says whether the documents are scored with BM25, buildBM25
+			must have been called first
+		arg5: int
+			The number of documents to return per query, None for all
+
+		Returns
+		-------
+		list
+			A list of lists where the ith sub-list holds the (document ID,
+			score) pairs of the ith query, best first
+		"""
+
+		if isBM25:
+			all_scores = self.bm25.scores(self.queryVectors(queries, False))
+		else:
+			all_scores = self.similarities(queries, isLSA, isESA)
+
+		docIDs = self.index["docIDs"]
+		ranked = []
+		for scores in all_scores:
+			scores = np.asarray(scores)
+			top = self.topK(scores, k)
+			ranked.append([(docIDs[j], float(scores[j])) for j in top.tolist()])
+		return ranked
+
+	def rankPruned(self, queries, k):
+		"""
+		Top k documents for each query by tfidf cosine similarity, scored
+		document-at-a-time over the postings of the query terms only,
+		with MaxScore pruning of the docs that cannot enter the top k
+
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of lists where each sub-list is a query and
+			each sub-sub-list is a sentence of the query
+
+		arg2: int
+			The number of documents to return per query
+
+		Returns
+		-------
+		list
+			A list of lists of k integers where the ith sub-list is a list of IDs
+			of the top k documents for the ith query, in decreasing order of
+			relevance. If fewer than k documents share a term with the query,
+			the list is completed with the remaining documents in decreasing
+			index order, as they are ranked by rank
+		"""
+
+		if self.maxScore is None:
+			self.buildMaxScore()
+
+		docIDs = self.index["docIDs"]
+		k = min(k, len(docIDs))
+
+		doc_IDs_ordered = []
+		tfidf = self.queryVectors(queries)
+		for query_index in range(len(queries)):
+			start, end = tfidf.indptr[query_index], tfidf.indptr[query_index + 1]
+			top = self.maxScore.topK(tfidf.indices[start:end].tolist(),
+				tfidf.data[start:end].tolist(), k)
+			doc_indices = [doc_index for doc_index, score in top]
+			if len(doc_indices) < k:
+				retrieved = set(doc_indices)
+				for doc_index in range(len(docIDs) - 1, -1, -1):
+					if len(doc_indices) == k:
+						break
+					if doc_index not in retrieved:
+						doc_indices.append(doc_index)
+			doc_IDs_ordered.append([docIDs[j] for j in doc_indices])
+
+		return doc_IDs_ordered
+
+	def buildBM25(self, k1=1.2, b=0.75, delta=0.0):
+		"""
+		Precomputes the BM25 (BM25+ if delta > 0) impacts of the
+		postings of the current index
+
+		Parameters
+		----------
+		arg1 : float
+			Term frequency saturation
+		arg2 : float
+			Strength of the document length normalization
+		arg3 : float
+			The BM25+ lower bound of a matched term's score
+		Returns
+		-------
+		None
+		"""
+
+		self.bm25 = BM25(k1, b, delta)
+		prefix = "bm25plus" if delta > 0 else "bm25"
+		if prefix + "_impacts" in self.index and \
+			np.array_equal(self.index[prefix + "_params"], [k1, b, delta]):
+			# shared by the process that published the index, see sharedArrays
+			self.bm25.impacts = self.index[prefix + "_impacts"]
+		else:
+			self.bm25.buildImpacts(self.index["tf"])
+
+	def buildMaxScore(self):
+		"""
+		Prepares the postings rankPruned scores from, see MaxScore
+		"""
+		self.maxScore = MaxScore(self.index)
+
+	def sharedArrays(self):
+		"""
+		The arrays built for ranking on top of the index (BM25 impacts,
+		MaxScore postings), by key. Added to an index published to other
+		processes (see SharedIndex), they are used there by buildBM25 and
+		buildMaxScore instead of being built again
+
+		Returns
+		-------
+		dict
+			The arrays and sparse matrices, by index key
+		"""
+
+		arrays = {}
+		if self.bm25 is not None:
+			prefix = "bm25plus" if self.bm25.delta > 0 else "bm25"
+			arrays[prefix + "_impacts"] = self.bm25.impacts
+			arrays[prefix + "_params"] = np.array([self.bm25.k1, self.bm25.b, self.bm25.delta])
+		if self.maxScore is not None:
+			arrays.update(self.maxScore.arrays())
+		return arrays
+
+	def rankBM25(self, queries, k=None):
+		"""
+		Rank the documents according to their BM25 score for each query,
+		buildBM25 must have been called first
+
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of lists where each sub-list is a query and
+			each sub-sub-list is a sentence of the query
+
+		arg2: int
+			The number of documents to return per query, None for all
+
+		Returns
+		-------
+		list
+			A list of lists of integers where the ith sub-list is a list of IDs
+			of documents in their predicted order of relevance to the ith query
+		"""
+
+		docIDs = self.index["docIDs"]
+		all_scores = self.bm25.scores(self.queryVectors(queries, False))
+
+		doc_IDs_ordered = []
+		for i in all_scores:
+			sorted_scores = self.topK(i, k)
+			doc_IDs_ordered.append([docIDs[j] for j in sorted_scores])
 
 		return doc_IDs_ordered
@@ -1,61 +1,113 @@
 import numpy as np
+from scipy.sparse.linalg import svds
 
 class LSA():
 
-    def reduced_tfidf(self, tfidf):
+    def reduced_tfidf(self, tfidf, k=300, isRandomized=True):
         """
 		Parameters
 		----------
 		arg1 : matrix
 			The tfidf matrix of all the docs with all the terms in the corpus
+			(a dense array or a scipy sparse matrix, used as is)
+		arg2 : int
+			The number of singular values to keep
+		arg3 : boolean
+			Says whether to use the randomized SVD, or the exact truncated one (svds)
 		Returns
 		-------
-			The reduced tfidf matrix and the matrices obtained after SVD
-            and reducing the dimensionality
+			The matrices obtained after SVD and reducing the dimensionality
+            (only the top-k factors are ever computed)
 		"""
-        tfidf = np.transpose(tfidf)
-        len_corpus = np.shape(tfidf)[0]
-        len_docs = np.shape(tfidf)[1]
-
-        u,s,vt = np.linalg.svd(tfidf); # u: txt, s: txd, vt = dxd
-        s_size = np.size(s) # 1400 = d
-        s_values = np.zeros([len_corpus, len_docs]) # txd
-        s_values[:s_size, :s_size] = np.diag(s) # dxd is diagonal
-        us = np.dot(u,s_values) # txd
-        tfidf1 = np.dot(us, vt) # txd
-
-        s_values_k = s_values[:300, :300] # sxs
-        u_k = u[:, :300] # txs
-        vt_k = vt[:300, :] # sxd
-        us_k = np.dot(u_k,s_values_k) # txs
-        tfidf_k = np.dot(us_k, vt_k) # txd
-
-        return tfidf_k, u_k, s_values_k, vt_k
-
-    def cosine_similarity(self, T, S, D, tfidf_query):
+        tfidf = tfidf.T # txd
+
+        if(isRandomized == True):
+            u_k, s_k, vt_k = self.randomized_svd(tfidf, k)
+        else:
+            k = min(k, min(tfidf.shape) - 1) # svds needs k < min(t, d)
+            u_k, s_k, vt_k = svds(tfidf, k=k) # ascending singular values
+            order = np.argsort(s_k)[::-1]
+            u_k, s_k, vt_k = u_k[:, order], s_k[order], vt_k[order, :]
+
+        return u_k, s_k, vt_k # txs, s, sxd
+
+    def randomized_svd(self, A, k, oversamples=10, n_iter=4, seed=0):
+        """
+		Randomized truncated SVD (Halko, Martinsson and Tropp) - the range of
+        A is sampled with a random projection refined by a few power iterations,
+        and only a small (k + oversamples) x d matrix is decomposed exactly
+
+		Parameters
+		----------
+		arg1 : matrix
+			The matrix to decompose, dense or sparse
+		arg2 : int
+			The number of singular values to keep
+		arg3 : int
+			Extra random directions sampled for accuracy
+		arg4 : int
+			Number of power iterations
+		arg5 : int
+			Seed of the random projection, fixed so that builds are reproducible
+		Returns
+		-------
+			The top-k left singular vectors, singular values (as a vector)
+            and right singular vectors
+		"""
+        k = min(k, min(A.shape))
+        size = min(k + oversamples, min(A.shape))
+        random_state = np.random.RandomState(seed)
+
+        # orthonormal basis of the (approximate) range of A
+        Q, _ = np.linalg.qr(A.dot(random_state.normal(size=(A.shape[1], size))))
+        for _ in range(n_iter):
+            Z, _ = np.linalg.qr(A.T.dot(Q))
+            Q, _ = np.linalg.qr(A.dot(Z))
+
+        # exact SVD of the small projected matrix Qt.A
+        B = np.transpose(A.T.dot(Q))
+        u_b, s, vt = np.linalg.svd(B, full_matrices=False)
+        u = np.dot(Q, u_b)
+
+        return u[:, :k], s[:k], vt[:k, :]
+
+    def doc_embeddings(self, S, D):
+        """
+		Parameters
+		----------
+		arg1 : vector
+			Singular values after SVD on tfidf matrix
+        arg2 : matrix
+			Docs in concept space, after SVD and reducing dimensionality
+		Returns
+		-------
+			The L2-normalized D.S embeddings of all the docs (dxs),
+            rows of docs with a zero embedding are left as zeros
+		"""
+        DS_docs_matrix = D * S # dxs
+        norms = np.linalg.norm(DS_docs_matrix, axis=1)
+        norms[norms == 0] = 1
+        return DS_docs_matrix / norms[:, np.newaxis]
+
+    def cosine_similarity(self, T, doc_embeddings, tfidf_queries):
         """
 		Parameters
 		----------
 		arg1 : matrix
 			Terms in concept space, after SVD and reducing dimensionality
         arg2 : matrix
-			Singular values after SVD on tfidf matrix
+			The normalized embeddings of the docs, from doc_embeddings
         arg3 : matrix
-			Docs in concept space, after SVD and reducing dimensionality
-        arg4 : vector
-			The tfidf vector of a query with all the terms in the corpus
+			The tfidf vectors of a batch of queries (qxt, dense or sparse)
 		Returns
 		-------
-			The cosine similarities of the query with all the documents in the dataset
+			The cosine similarities of the queries with all the documents
+            in the dataset (qxd)
 		"""
-        DS_docs_matrix = np.dot(D, S) # dxs
-        DS_query = np.dot(tfidf_query,T) # 1xs
-
-        cosine_sims = []
-        for DS_doc in DS_docs_matrix: # 1xs
-            if np.linalg.norm(DS_doc) == 0:
-                cosine_sim = 0
-            else:
-                cosine_sim = np.dot(DS_query, DS_doc)/((np.linalg.norm(DS_query)) * (np.linalg.norm(DS_doc)))
-            cosine_sims.append(cosine_sim)
+        DS_queries = np.asarray(tfidf_queries.dot(T)) # qxs
+
+        query_norms = np.linalg.norm(DS_queries, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine_sims = np.dot(DS_queries, doc_embeddings.T) / query_norms[:, np.newaxis]
+        cosine_sims[query_norms == 0, :] = 0 # queries with no term in the corpus
         return cosine_sims
@@ -3,13 +3,27 @@ from tokenization import Tokenization
 from inflectionReduction import InflectionReduction
 from stopwordRemoval import StopwordRemoval
 from informationRetrieval import InformationRetrieval
-from evaluation import Evaluation
+from evaluation import Evaluation, Qrels
 from esa import ESA # ESA
 from spellcheck import SpellCheck # spellcheck
-
+from preprocessingCache import PreprocessingCache
+from spimi import SPIMIIndexer
+from segmentedIndex import SegmentedIndex
+from shardedIndexer import ShardedIndexer
+from shardCoordinator import ShardCoordinator
+from searchServer import SearchServer, ServingState, WorkerPoolState
+from sharedIndex import SharedIndex
+from asyncSearchServer import AsyncSearchServer
+
+from collections import deque
 from sys import version_info
+from multiprocessing import Pool
 import argparse
+import asyncio
 import json
+import os
+import signal
+import time
 import matplotlib.pyplot as plt
 
 # Input compatibility for Python 2 and Python 3
@@ -34,6 +48,8 @@ class SearchEngine:
 		self.addLSA = False
 		self.addESA = False
 		self.isBestModel = False
+		self.addBM25 = False
+		self.isBM25Plus = False
 		if model == 0:
 			self.isVSM = True
 		elif model == 1:
@@ -47,18 +63,26 @@ class SearchEngine:
 		elif model == 5:
 			self.isBestModel = True
 			self.addLSA = True
+		elif model == 6:
+			self.addBM25 = True
+		elif model == 7:
+			self.addBM25 = True
+			self.isBM25Plus = True
 
+		self.model = model
 		self.method = method
 
 		self.tokenizer = Tokenization()
 		self.sentenceSegmenter = SentenceSegmentation()
-		self.inflectionReducer = InflectionReduction()
+		self.inflectionReducer = InflectionReduction(args.stem_cache_size)
 		self.stopwordRemover = StopwordRemoval()
 
 		self.informationRetriever = InformationRetrieval()
 		self.evaluator = Evaluation()
 
 		self.esa = ESA() # ESA
+		if args.cache_dir:
+			self.preprocessingCache = PreprocessingCache(args.cache_dir)
 		self.spellcheck = SpellCheck() # SpellCheck
 
 
@@ -93,6 +117,54 @@ class SearchEngine:
 		return self.stopwordRemover.fromList(text, isQueryExpansion)
 
 
+	def preprocessText(self, text, isQueryExpansion=False):
+		"""
+		Preprocess a single document or query - segment, tokenize,
+		stem/lemmatize and remove stopwords
+
+		Returns the output of each of the four stages, the last one
+		being the preprocessed text
+		"""
+		segmentedText = self.segmentSentences(text)
+		tokenizedText = self.tokenize(segmentedText)
+		reducedText = self.reduceInflection(tokenizedText)
+		stopwordRemovedText = self.removeStopwords(reducedText, isQueryExpansion)
+		return [segmentedText, tokenizedText, reducedText, stopwordRemovedText]
+
+	def preprocessStream(self, texts, name, isQueryExpansion=False, useWorkers=True):
+		"""
+		Preprocess the texts one at a time, yielding each preprocessed text
+		as soon as it is ready, so that only one text is held in memory at a time
+
+		With the -dump_stages flag, the output of each stage is also streamed
+		to <stage>_<name>.jsonl in the output folder, one text per line.
+		With -workers, they are preprocessed by a pool of processes, unless
+		useWorkers is False
+		"""
+		dumps = []
+		if self.args.dump_stages:
+			dumps = [open(self.args.out_folder + stage + "_" + name + ".jsonl", 'w')
+				for stage in ["segmented", "tokenized", "reduced", "stopword_removed"]]
+		pool = None
+		try:
+			if self.args.workers > 1 and useWorkers:
+				# texts are sharded across the pool in chunks, imap keeps them in order
+				pool = Pool(self.args.workers, initPreprocessingWorker, (self.args,))
+				tasks = ((text, isQueryExpansion) for text in texts)
+				results = pool.imap(preprocessInWorker, tasks, chunksize=16)
+			else:
+				results = (self.preprocessText(text, isQueryExpansion) for text in texts)
+
+			for stages in results:
+				for fout, stage in zip(dumps, stages):
+					fout.write(json.dumps(stage) + "\n")
+				yield stages[-1]
+		finally:
+			if pool is not None:
+				pool.terminate()
+			for fout in dumps:
+				fout.close()
+
 	def preprocessQueries(self, queries, isSpellCheck, isQueryExpansion): # CHANGE AFTER COMPARISON
 		"""
 		Preprocess the queries - segment, tokenize, stem/lemmatize and remove stopwords
@@ -102,82 +174,193 @@ class SearchEngine:
 		if(isSpellCheck): # Perform spellcheck if isSpellCheck is True
 			queries = [self.spellcheck.correctQuery(query) for query in queries]
 
-		# Segment queries
-		segmentedQueries = []
-		for query in queries:
-			segmentedQuery = self.segmentSentences(query)
-			segmentedQueries.append(segmentedQuery)
-		json.dump(segmentedQueries, open(self.args.out_folder + "segmented_queries.txt", 'w'))
-		# Tokenize queries
-		tokenizedQueries = []
-		for query in segmentedQueries:
-			tokenizedQuery = self.tokenize(query)
-			tokenizedQueries.append(tokenizedQuery)
-		json.dump(tokenizedQueries, open(self.args.out_folder + "tokenized_queries.txt", 'w'))
-		# Stem/Lemmatize queries
-		reducedQueries = []
-		for query in tokenizedQueries:
-			reducedQuery = self.reduceInflection(query)
-			reducedQueries.append(reducedQuery)
-		json.dump(reducedQueries, open(self.args.out_folder + "reduced_queries.txt", 'w'))
-		# Remove stopwords from queries
-		stopwordRemovedQueries = []
-		for query in reducedQueries:
-			stopwordRemovedQuery = None
-			if isQueryExpansion: # Perform Query Expansion if isQueryExpansion is True
-				stopwordRemovedQuery = self.removeStopwords(query, True)
-			else:
-				stopwordRemovedQuery = self.removeStopwords(query)
-			stopwordRemovedQueries.append(stopwordRemovedQuery)
-		json.dump(stopwordRemovedQueries, open(self.args.out_folder + "stopword_removed_queries.txt", 'w'))
-
-		preprocessedQueries = stopwordRemovedQueries
+		# Perform Query Expansion if isQueryExpansion is True
+		# a single query (custom or served) is not worth starting a pool
+		preprocessedQueries = list(self.preprocessStream(queries, "queries", isQueryExpansion, len(queries) > 1))
 		return preprocessedQueries
 
 	def preprocessDocs(self, docs, isConcepts = False):
 		"""
 		Preprocess the documents
+
+		Returns a generator - the documents are preprocessed one at a time
+		while it is consumed (for example by InformationRetrieval.buildIndex)
 		"""
 
-		# Segment docs
-		segmentedDocs = []
-		for doc in docs:
-			segmentedDoc = self.segmentSentences(doc)
-			segmentedDocs.append(segmentedDoc)
-		if(isConcepts):
-			json.dump(segmentedDocs, open(self.args.out_folder + "segmented_concepts.txt", 'w'))
-		else:
-			json.dump(segmentedDocs, open(self.args.out_folder + "segmented_docs.txt", 'w'))
-		# Tokenize docs
-		tokenizedDocs = []
-		for doc in segmentedDocs:
-			tokenizedDoc = self.tokenize(doc)
-			tokenizedDocs.append(tokenizedDoc)
 		if(isConcepts):
-			json.dump(tokenizedDocs, open(self.args.out_folder + "tokenized_concepts.txt", 'w'))
+			return self.preprocessStream(docs, "concepts")
 		else:
-			json.dump(tokenizedDocs, open(self.args.out_folder + "tokenized_docs.txt", 'w'))
-		# Stem/Lemmatize docs
-		reducedDocs = []
-		for doc in tokenizedDocs:
-			reducedDoc = self.reduceInflection(doc)
-			reducedDocs.append(reducedDoc)
-		if(isConcepts):
-			json.dump(reducedDocs, open(self.args.out_folder + "reduced_concepts.txt", 'w'))
-		else:
-			json.dump(reducedDocs, open(self.args.out_folder + "reduced_docs.txt", 'w'))
-		# Remove stopwords from docs
-		stopwordRemovedDocs = []
-		for doc in reducedDocs:
-			stopwordRemovedDoc = self.removeStopwords(doc)
-			stopwordRemovedDocs.append(stopwordRemovedDoc)
-		if(isConcepts):
-			json.dump(stopwordRemovedDocs, open(self.args.out_folder + "stopword_removed_concepts.txt", 'w'))
-		else:
-			json.dump(stopwordRemovedDocs, open(self.args.out_folder + "stopword_removed_docs.txt", 'w'))
+			return self.preprocessStream(docs, "docs")
+
+	def loadProcessedDocs(self, path, field, isConcepts = False):
+		"""
+		Read a json file of documents (or concepts) and preprocess the text in
+		the given field of each of them
+
+		With -cache_dir, the preprocessed documents are stored in the
+		preprocessing cache, keyed by the file contents and the preprocessing
+		configuration, and loaded from it on the next runs
+
+		Returns the items of the json file and a generator of the preprocessed texts
+		"""
+		items = json.load(open(path, 'r'))[:]
+		if not self.args.cache_dir:
+			return items, self.preprocessDocs([item[field] for item in items], isConcepts)
+
+		key = self.preprocessingCache.key(path, self.preprocessingConfig(field))
+		processedDocs = self.preprocessingCache.load(key)
+		if processedDocs is not None:
+			print("Preprocessed " + path + " loaded from the cache")
+			return items, processedDocs
+		processedDocs = self.preprocessDocs([item[field] for item in items], isConcepts)
+		return items, self.preprocessingCache.record(key, processedDocs)
+
+	def preprocessingConfig(self, field):
+		"""
+		Everything that changes the output of preprocessDocs, apart from the input file
+		"""
+		return {
+			"field" : field,
+			"segmenter" : self.args.segmenter,
+			"tokenizer" : self.args.tokenizer,
+			"stemmer" : "porter",
+			"stopwords" : "nltk-english"
+		}
+
+	def buildDocsIndex(self):
+		"""
+		Load the document index from the index folder if it holds one built
+		with the same preprocessing, otherwise preprocess the documents,
+		build the index and save it there
+		"""
+		params = self.indexParams()
+		if self.args.index_dir and self.informationRetriever.loadIndex(self.args.index_dir, params):
+			print("Index loaded from " + self.args.index_dir)
+			return
+
+		# Read and process documents
+		docs_json, processedDocs = self.loadProcessedDocs(self.args.dataset + "cran_docs.json", "body")
+		doc_ids = [item["id"] for item in docs_json]
+
+		# Build document index, in memory, with the external-memory SPIMI builder
+		# or with the sharded builder
+		indexer = None
+		if self.args.memory_budget:
+			spimi_dir = os.path.join(self.args.index_dir or self.args.out_folder, "spimi")
+			indexer = SPIMIIndexer(spimi_dir, int(self.args.memory_budget * 1024 * 1024))
+		elif self.args.index_workers > 1:
+			indexer = ShardedIndexer(self.args.index_workers, self.args.partition_size)
+		self.informationRetriever.buildIndex(processedDocs, doc_ids, False, indexer)
+		self.printCacheStats()
+		if self.args.index_dir:
+			self.informationRetriever.saveIndex(self.args.index_dir, params)
+
+	def printCacheStats(self):
+		"""
+		Print the hit rate of the stemming memo cache (of this process,
+		the workers of the -workers pool keep their own caches)
+		"""
+		info = self.inflectionReducer.cacheInfo()
+		print("Stemming cache - hits : " + str(info["hits"]) + ", misses : " + str(info["misses"]) +
+			", hit rate : " + str(round(info["hit_rate"], 4)) +
+			", size : " + str(info["size"]) + "/" + str(info["max_size"]))
+
+	def addLSAToIndex(self):
+		"""
+		Add the LSA factors to the document index, unless the loaded index has them already
+		"""
+		if self.informationRetriever.hasLSA(self.args.lsa_k):
+			return
+		self.informationRetriever.buildLSA(self.args.lsa_k, self.args.lsa_svd == "randomized")
+		if self.args.index_dir:
+			self.informationRetriever.saveIndex(self.args.index_dir, self.indexParams())
+
+	def addCompressedPostingsToIndex(self):
+		"""
+		Add compressed postings to the document index, unless the loaded index has them already
+		"""
+		if self.informationRetriever.hasCompressedPostings():
+			return
+		compressed_size, uncompressed_size = self.informationRetriever.compressPostings()
+		print("Postings compressed from " + str(uncompressed_size) + " to " + str(compressed_size) +
+			" bytes (" + str(round(compressed_size/float(uncompressed_size), 4)) + ")")
+		if self.args.index_dir:
+			self.informationRetriever.saveIndex(self.args.index_dir, self.indexParams())
+
+	def updateSegmentedIndex(self):
+		"""
+		Load the updatable index from the segments folder (or start it from the
+		document index), apply the -add_docs and -delete_docs updates and save it
+		"""
+		segmentedIndex = SegmentedIndex.load(self.args.segments_dir)
+		if segmentedIndex is None:
+			self.buildDocsIndex()
+			segmentedIndex = SegmentedIndex.fromIndex(self.informationRetriever.index)
+
+		if self.args.add_docs:
+			docs_json, processedDocs = self.loadProcessedDocs(self.args.add_docs, "body")
+			segmentedIndex.addDocuments(processedDocs, [item["id"] for item in docs_json])
+		if self.args.delete_docs:
+			segmentedIndex.deleteDocuments([int(docID) for docID in self.args.delete_docs.split(",")])
+
+		segmentedIndex.save(self.args.segments_dir)
+		print("Segmented index : " + str(segmentedIndex.num_docs) + " documents in " +
+			str(len(segmentedIndex.segments)) + " segments")
+		return segmentedIndex
+
+	def rankWithShards(self, queries, k):
+		"""
+		Partition the documents across -shards worker processes and rank
+		the queries by scatter-gather over them
+		"""
+		docs_json, processedDocs = self.loadProcessedDocs(self.args.dataset + "cran_docs.json", "body")
+		coordinator = ShardCoordinator(self.args.shards)
+		try:
+			coordinator.buildIndex(processedDocs, [item["id"] for item in docs_json])
+			return coordinator.rank(queries, k)
+		finally:
+			coordinator.stop()
+
+	def buildBM25(self):
+		"""
+		Precompute the BM25 impacts with the parameters given as arguments
+		(the delta of BM25+ only for model 7)
+		"""
+		delta = self.args.delta if self.isBM25Plus else 0.0
+		self.informationRetriever.buildBM25(self.args.k1, self.args.b, delta)
+
+	def addESAToIndex(self):
+		"""
+		Build the concept index and add the concept vectors of the docs to
+		the document index, unless the loaded index has them already
+		"""
+		if self.informationRetriever.hasESA(self.args.esa_top_n):
+			return
+
+		# get summary/content of the concepts from wikipedia
+		# - RAN ONCE (2.5 hr process) and stored in wikipedia_concepts_only_summary.json and wikipedia_concepts_whole_content.json
+		# doc_titles = [item["title"] for item in docs_json]
+		# self.esa.GetConceptsFromWikipedia(doc_titles)
+		# ("summary" field of wikipedia_concepts_only_summary.json for summary)
 
-		preprocessedDocs = stopwordRemovedDocs
-		return preprocessedDocs
+		# Read and process concepts - content
+		concepts_json, processedConcepts = self.loadProcessedDocs("wikipedia_concepts_whole_content.json", "content", True)
+		self.esa.buildConceptsIndex(processedConcepts, self.args.esa_top_n)
+
+		# Concept vectors of the docs, computed once
+		self.informationRetriever.buildESA(self.args.esa_top_n)
+		if self.args.index_dir:
+			self.informationRetriever.saveIndex(self.args.index_dir, self.indexParams())
+
+	def indexParams(self):
+		"""
+		The parameters a saved index must match to be reused
+		"""
+		return {
+			"dataset" : self.args.dataset,
+			"segmenter" : self.args.segmenter,
+			"tokenizer" : self.args.tokenizer
+		}
 
 	def getProcessedQueries(self, queries):
 		"""
@@ -195,28 +378,15 @@ class SearchEngine:
 		Calculate and plot the evaluation metrics according to the model
 		"""
 		# Calculate precision, recall, f-score, MAP and nDCG for k = 1 to 10
-		precisions, recalls, fscores, MAPs, nDCGs = [], [], [], [], []
+		metrics = self.evaluator.meanMetrics(doc_IDs_ordered, query_ids, qrels, 10)
+		precisions, recalls, fscores = metrics["precision"].tolist(), metrics["recall"].tolist(), metrics["fscore"].tolist()
+		MAPs, nDCGs = metrics["MAP"].tolist(), metrics["nDCG"].tolist()
 		for k in range(1, 11):
-			precision = self.evaluator.meanPrecision(
-				doc_IDs_ordered, query_ids, qrels, k)
-			precisions.append(precision)
-			recall = self.evaluator.meanRecall(
-				doc_IDs_ordered, query_ids, qrels, k)
-			recalls.append(recall)
-			fscore = self.evaluator.meanFscore(
-				doc_IDs_ordered, query_ids, qrels, k)
-			fscores.append(fscore)
 			print("Precision, Recall and F-score @ " +
-				str(k) + " : " + str(precision) + ", " + str(recall) +
-				", " + str(fscore))
-			MAP = self.evaluator.meanAveragePrecision(
-				doc_IDs_ordered, query_ids, qrels, k)
-			MAPs.append(MAP)
-			nDCG = self.evaluator.meanNDCG(
-				doc_IDs_ordered, query_ids, qrels, k)
-			nDCGs.append(nDCG)
+				str(k) + " : " + str(precisions[k - 1]) + ", " + str(recalls[k - 1]) +
+				", " + str(fscores[k - 1]))
 			print("MAP, nDCG @ " +
-				str(k) + " : " + str(MAP) + ", " + str(nDCG))
+				str(k) + " : " + str(MAPs[k - 1]) + ", " + str(nDCGs[k - 1]))
 
 		#Plot the metrics and save plot
 		plt.figure()
@@ -235,24 +405,15 @@ class SearchEngine:
 		Calculate and plot the precisions and recalls for VSM and a new model for ease of comparison
 		"""
 
-		precisions, recalls = [], []
-		for k in range(1, 101):
-			precision = self.evaluator.meanPrecision(
-				doc_IDs_ordered_old, query_ids, qrels, k)
-			precisions.append(precision)
-			recall = self.evaluator.meanRecall(
-				doc_IDs_ordered_old, query_ids, qrels, k)
-			recalls.append(recall)
+		# Calculate precision and recall for k = 1 to 100 - for VSM, the
+		# judgements are grouped by query once for both models
+		qrels = Qrels(qrels)
+		metrics = self.evaluator.meanMetrics(doc_IDs_ordered_old, query_ids, qrels, 100)
+		precisions, recalls = metrics["precision"].tolist(), metrics["recall"].tolist()
 
-		# Calculate precision, recall, f-score, MAP and nDCG for k = 1 to 10
-		precisions_new, recalls_new = [], []
-		for k in range(1, 101):
-			precision = self.evaluator.meanPrecision(
-				doc_IDs_ordered_new, query_ids, qrels, k)
-			precisions_new.append(precision)
-			recall = self.evaluator.meanRecall(
-				doc_IDs_ordered_new, query_ids, qrels, k)
-			recalls_new.append(recall)
+		# Calculate precision and recall for k = 1 to 100 - for the new model
+		metrics_new = self.evaluator.meanMetrics(doc_IDs_ordered_new, query_ids, qrels, 100)
+		precisions_new, recalls_new = metrics_new["precision"].tolist(), metrics_new["recall"].tolist()
 
 		# Plot the metrics and save plot
 		label = None
@@ -269,6 +430,12 @@ class SearchEngine:
 		elif(self.addESA):
 			label = "ESA"
 			savename = "esa"
+		elif(self.isBM25Plus):
+			label = "BM25+"
+			savename = "bm25plus"
+		elif(self.addBM25):
+			label = "BM25"
+			savename = "bm25"
 		if(self.isBestModel):
 			plt.figure()
 			plt.plot(recalls, precisions, label="VSM");
@@ -292,13 +459,16 @@ class SearchEngine:
 		return
 
 
-	def evaluateDataset(self):
+	def evaluateDataset(self, k=None):
 		"""
 		- preprocesses the queries and documents, stores in output folder
 		- invokes the IR system
 		- evaluates precision, recall, fscore, nDCG and MAP
 		  for all queries in the Cranfield dataset
 		- produces graphs of the evaluation metrics in the output folder
+
+		k is the number of documents ranked per query. The default (None)
+		ranks every document, which the nDCG computation relies on
 		"""
 
 		# Read queries
@@ -312,41 +482,26 @@ class SearchEngine:
 		# Process queries - new model
 		processedQueries_new = self.getProcessedQueries(queries)
 
-		# Read documents
-		docs_json = json.load(open(args.dataset + "cran_docs.json", 'r'))[:]
-		doc_ids, docs = [item["id"] for item in docs_json], \
-								[item["body"] for item in docs_json]
-		# Process documents
-		processedDocs = self.preprocessDocs(docs)
-
-		# Build document index
-		self.informationRetriever.buildIndex(processedDocs, doc_ids, False) # --> Without LSA - CHECK IF PROBLEMATIC
+		# Build (or load) document index
+		self.buildDocsIndex() # --> Without LSA
 
 		# --- ESA ---
 		if(self.addESA):
-			# Read concepts
-			concepts_json = json.load(open("wikipedia_concepts_whole_content.json", 'r'))[:]
-
-			# get summary/content of the concepts from wikipedia
-			# - RAN ONCE (2.5 hr process) and stored in wikipedia_concepts_only_summary.json and wikipedia_concepts_whole_content.json
-			# doc_titles = [item["title"] for item in docs_json]
-			# self.esa.GetConceptsFromWikipedia(doc_titles)
-			# concepts = [item["summary"] for item in concepts_json] # for summary
-			concepts = [item["content"] for item in concepts_json] # for content
-
-			# Process concepts
-			processedConcepts = self.preprocessDocs(concepts, True)
-			self.esa.buildConceptsIndex(processedConcepts)
+			self.addESAToIndex()
 
 		# Rank the documents for each query - for VSM
-		doc_IDs_ordered_old = self.informationRetriever.rank(processedQueries_old, False, False) # without anything
+		doc_IDs_ordered_old = self.informationRetriever.rank(processedQueries_old, False, False, k) # without anything
 
 		if(self.addLSA):
-			# Build document index with LSA
-			self.informationRetriever.buildIndex(processedDocs, doc_ids, True) # --> With LSA
+			# Add LSA to the document index
+			self.addLSAToIndex() # --> With LSA
 
 		# Rank the documents for each query - for new model
-		doc_IDs_ordered_new = self.informationRetriever.rank(processedQueries_new, self.addLSA, self.addESA)
+		if(self.addBM25):
+			self.buildBM25()
+			doc_IDs_ordered_new = self.informationRetriever.rankBM25(processedQueries_new, k)
+		else:
+			doc_IDs_ordered_new = self.informationRetriever.rank(processedQueries_new, self.addLSA, self.addESA, k)
 
 		# Read relevance judements
 		qrels = json.load(open(args.dataset + "cran_qrels.json", 'r'))[:]
@@ -363,41 +518,255 @@ class SearchEngine:
 				self.plotEvaluationMetrics(doc_IDs_ordered_new, query_ids, qrels, " with LSA ", "eval_plot_lsa")
 			elif(self.addESA):
 				self.plotEvaluationMetrics(doc_IDs_ordered_new, query_ids, qrels, " with ESA ", "eval_plot_esa")
+			elif(self.isBM25Plus):
+				self.plotEvaluationMetrics(doc_IDs_ordered_new, query_ids, qrels, " with BM25+ ", "eval_plot_bm25plus")
+			elif(self.addBM25):
+				self.plotEvaluationMetrics(doc_IDs_ordered_new, query_ids, qrels, " with BM25 ", "eval_plot_bm25")
 			else:
 				self.plotEvaluationMetrics(doc_IDs_ordered_new, query_ids, qrels, " ", "eval_plot_vsm")
 		elif(self.method == 'comp'):
 			if(self.isVSM == False):
 				self.plotPRCurves(doc_IDs_ordered_old, doc_IDs_ordered_new, query_ids, qrels)
 
-	def handleCustomQuery(self):
+	def prepareModel(self):
+		"""
+		Add what the model needs to the document index (LSA factors, ESA
+		concept vectors, BM25 impacts, compressed postings, MaxScore postings),
+		buildDocsIndex must have been called first
+		"""
+		if(self.addLSA):
+			self.addLSAToIndex()
+		if(self.addESA):
+			self.addESAToIndex()
+		if self.addBM25:
+			self.buildBM25()
+		elif self.args.daat and not (self.addLSA or self.addESA):
+			if self.args.compress_postings:
+				self.addCompressedPostingsToIndex()
+			self.informationRetriever.buildMaxScore()
+
+	def rankQueries(self, processedQueries, k):
+		"""
+		Rank the documents for preprocessed queries with the model, only
+		the top k are selected. prepareModel must have been called first
+		"""
+		if self.addBM25:
+			return self.informationRetriever.rankBM25(processedQueries, k)
+		elif self.args.daat and not (self.addLSA or self.addESA):
+			return self.informationRetriever.rankPruned(processedQueries, k)
+		else:
+			return self.informationRetriever.rank(processedQueries, self.addLSA, self.addESA, k)
+
+	def readQueryFile(self, path):
+		"""
+		Stream the (query id, query) pairs of a query file - a json list in
+		the format of cran_queries.json, or tab-separated "id<TAB>query" lines
+		(a line without a tab is skipped, with a message giving its number)
+		"""
+		if path.endswith(".json"):
+			for item in json.load(open(path, 'r')):
+				yield str(item["query number"]), item["query"]
+			return
+		with open(path, 'r') as fin:
+			for line_number, line in enumerate(fin, 1):
+				line = line.rstrip("\n")
+				if line.strip() == "":
+					continue
+				if "\t" not in line:
+					print("Skipped line " + str(line_number) + " of " + path + " : no tab between the id and the query")
+					continue
+				query_id, query = line.split("\t", 1)
+				yield query_id, query
+
+	def rankQueryFile(self, path, run_file, depth=1000, batch_size=256, tag=None):
+		"""
+		Rank the documents for every query of a query file, in batches of
+		batch_size queries scored together, and stream the top depth
+		documents of each query to a TREC run file, one
+		"qid Q0 docid rank score tag" line per document
+		"""
+		tag = tag or "model" + str(self.model)
+
+		# Build (or load) document index
+		self.buildDocsIndex()
+		self.prepareModel()
+
+		# the ids are queued as the texts are read, and dequeued as their preprocessing comes out
+		query_ids = deque()
+		def queryTexts():
+			for query_id, query in self.readQueryFile(path):
+				query_ids.append(query_id)
+				yield self.spellcheck.correctQuery(query) if self.addSpellCheck else query
+
+		num_queries = 0
+		start = time.time()
+		with open(run_file, 'w') as fout:
+			batch_ids, batch = [], []
+			for processedQuery in self.preprocessStream(queryTexts(), "queries", self.addQueryExpansion):
+				batch_ids.append(query_ids.popleft())
+				batch.append(processedQuery)
+				if len(batch) == batch_size:
+					self.writeRun(fout, batch_ids, batch, depth, tag)
+					num_queries += len(batch)
+					batch_ids, batch = [], []
+			if len(batch) > 0:
+				self.writeRun(fout, batch_ids, batch, depth, tag)
+				num_queries += len(batch)
+
+		print("Ranked " + str(num_queries) + " queries in " + str(round(time.time() - start, 2)) +
+			" s, run written to " + run_file)
+
+	def writeRun(self, fout, query_ids, processedQueries, depth, tag):
+		"""
+		Rank a batch of preprocessed queries and write their TREC run lines
+		"""
+		ranked = self.informationRetriever.rankWithScores(processedQueries, self.addLSA, self.addESA,
+			self.addBM25, depth)
+		for query_id, docs in zip(query_ids, ranked):
+			fout.write("".join(query_id + " Q0 " + str(doc_id) + " " + str(rank) + " " + repr(score) + " " + tag + "\n"
+				for rank, (doc_id, score) in enumerate(docs, 1)))
+
+	def handleCustomQuery(self, k=5):
 		"""
-		Take a custom query as input and return top five relevant documents
+		Take a custom query as input and return top k (five by default) relevant documents
 		"""
 
 		#Get query
 		print("Enter query below")
 		query = input()
 		# Process documents
-		processedQuery = self.preprocessQueries([query])[0]
+		processedQuery = self.getProcessedQueries([query])[0]
+
+		# With -segments_dir, the updatable index is searched instead (models 0, 1 and 2)
+		useSegments = self.args.segments_dir and not (self.addLSA or self.addESA or self.addBM25)
+		# With -shards, the documents are partitioned across shard processes instead (models 0, 1 and 2)
+		useShards = self.args.shards > 1 and not (useSegments or self.addLSA or self.addESA or self.addBM25)
+
+		# Rank the documents for the query, only the top k are selected
+		if useSegments:
+			doc_IDs_ordered = self.updateSegmentedIndex().rank([processedQuery], k)[0]
+		elif useShards:
+			doc_IDs_ordered = self.rankWithShards([processedQuery], k)[0]
+		else:
+			# Build (or load) document index
+			self.buildDocsIndex()
+			self.prepareModel()
+			doc_IDs_ordered = self.rankQueries([processedQuery], k)[0]
+
+		# Print the IDs of first k documents
+		print("\nTop " + str(k) + " document IDs : ")
+		for id_ in doc_IDs_ordered:
+			print(id_)
 
-		# Read documents
-		docs_json = json.load(open(args.dataset + "cran_docs.json", 'r'))[:]
-		doc_ids, docs = [item["id"] for item in docs_json], \
-							[item["body"] for item in docs_json]
-		# Process documents
-		processedDocs = self.preprocessDocs(docs)
 
-		# Build document index
-		self.informationRetriever.buildIndex(processedDocs, doc_ids)
-		# Rank the documents for the query
-		doc_IDs_ordered = self.informationRetriever.rank([processedQuery])[0]
 
-		# Print the IDs of first five documents
-		print("\nTop five document IDs : ")
-		for id_ in doc_IDs_ordered[:5]:
-			print(id_)
+def serve(args):
+	"""
+	Serve queries over HTTP until interrupted, see SearchServer. SIGHUP
+	reloads the index, like /reload
+	"""
+	args.dump_stages = False # the stages of served queries are not dumped
+	if args.async_batching:
+		serveBatched(args)
+		return
+	createState = ServingState
+	if args.query_workers > 0:
+		models = [int(model) for model in args.serve_models.split(",")]
+		createState = lambda createEngine: WorkerPoolState(createEngine, models, args.query_workers,
+			initQueryWorker, (args,), searchInWorker)
+	server = SearchServer(lambda model: SearchEngine(args, model, 'serve'), args.host, args.port, createState)
+	print("Loading the index")
+	server.load()
+	if server.state is None:
+		server.server_close()
+		return
+	if hasattr(signal, "SIGHUP"):
+		signal.signal(signal.SIGHUP, lambda signum, frame: server.reload())
+	print("Serving on http://" + args.host + ":" + str(args.port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		server.state.retire()
+
+
+def serveBatched(args):
+	"""
+	Serve queries with the asyncio front end, scoring concurrent queries
+	in micro-batches, until interrupted, see AsyncSearchServer. SIGHUP
+	reloads the index, like /reload
+	"""
+	server = AsyncSearchServer(lambda model: SearchEngine(args, model, 'serve'), args.host, args.port,
+		args.max_batch_size, args.max_wait_ms / 1000.0)
+	print("Loading the index")
+	server.load()
+	if server.state is None:
+		return
+	if hasattr(signal, "SIGHUP"):
+		signal.signal(signal.SIGHUP, lambda signum, frame: server.reload())
+	print("Serving on http://" + args.host + ":" + str(args.port) + " (micro-batches of up to " +
+		str(args.max_batch_size) + " queries, " + str(args.max_wait_ms) + " ms)")
+	try:
+		asyncio.run(server.serve())
+	except KeyboardInterrupt:
+		pass
 
 
+# SearchEngine of a worker process of the -workers preprocessing pool
+workerEngine = None
+
+def initPreprocessingWorker(args):
+	"""
+	Initializer of the preprocessing pool, sets up the preprocessing
+	objects of the worker process once
+	"""
+	global workerEngine
+	workerEngine = SearchEngine(args, 0, 'eval')
+
+def preprocessInWorker(task):
+	"""
+	Preprocess a (text, isQueryExpansion) task in a worker process. Only the
+	last stage is sent back unless the stages are being dumped
+	"""
+	text, isQueryExpansion = task
+	stages = workerEngine.preprocessText(text, isQueryExpansion)
+	if workerEngine.args.dump_stages:
+		return stages
+	return stages[-1:]
+
+
+# Shared index of a -query_workers process (attached blocks and index), and its SearchEngine of each model
+workerArgs = None
+workerIndex = None
+workerEngines = {}
+
+def initQueryWorker(args, descriptor):
+	"""
+	Initializer of the query workers, attaches to the shared document index
+	"""
+	global workerArgs, workerIndex
+	# interrupts are handled by the server, which stops the workers
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	workerArgs = args
+	workerIndex = SharedIndex.attach(descriptor)
+
+def searchInWorker(task):
+	"""
+	Rank a (queries, ks, model) task in a query worker, see ServingState.searchBatch
+	"""
+	queries, ks, model = task
+	if model not in workerEngines:
+		engine = SearchEngine(workerArgs, model, 'serve')
+		engine.informationRetriever.useIndex(workerIndex[1])
+		engine.prepareModel()
+		workerEngines[model] = engine
+	engine = workerEngines[model]
+	processedQueries = [engine.getProcessedQueries([query])[0] for query in queries]
+	doc_IDs_ordered = engine.rankQueries(processedQueries, max(ks))
+	return [doc_IDs[:k] for doc_IDs, k in zip(doc_IDs_ordered, ks)]
+
 
 if __name__ == "__main__":
 
@@ -415,34 +784,121 @@ if __name__ == "__main__":
 	                    help = "Tokenizer Type [naive|ptb]")
 	parser.add_argument('-custom', action = "store_true",
 						help = "Take custom query as input")
+	parser.add_argument('-dump_stages', action = "store_true",
+						help = "Save the output of each preprocessing stage to the output folder")
+	parser.add_argument('-workers', type = int, default = 1,
+						help = "Number of processes used to preprocess the documents, concepts and queries")
+	parser.add_argument('-stem_cache_size', type = int, default = 65536,
+						help = "Maximum number of stems kept in the stemming memo cache")
+	parser.add_argument('-k', type = int, default = 5,
+						help = "Number of documents to retrieve for a custom query")
+	parser.add_argument('-model', type = int, default = None, choices = range(8),
+						help = "Model number, instead of asking for it")
+	parser.add_argument('-method', default = None, choices = ['eval', 'comp'],
+						help = "What to do with the model, instead of asking for it")
+	parser.add_argument('-queries_file', default = None,
+						help = "Rank the queries of this file (json, or id<TAB>query lines) into a TREC run file")
+	parser.add_argument('-run_file', default = None,
+						help = "Path to the TREC run file (default: run.txt in the output folder)")
+	parser.add_argument('-depth', type = int, default = 1000,
+						help = "Number of documents per query in the TREC run file")
+	parser.add_argument('-run_tag', default = None,
+						help = "Tag of the TREC run (default: model<N>)")
+	parser.add_argument('-query_batch_size', type = int, default = 256,
+						help = "Number of queries of the query file scored together")
+	parser.add_argument('-index_dir', default = None,
+						help = "Path to a folder where the document index is saved once and reused")
+	parser.add_argument('-memory_budget', type = float, default = None,
+						help = "Build the postings with SPIMI, flushing them to disk past this many MB. "
+						"Only the inversion is bounded, not the tf-idf index built from the postings")
+	parser.add_argument('-index_workers', type = int, default = 1,
+						help = "Number of processes that build the postings, one partition of documents each")
+	parser.add_argument('-partition_size', type = int, default = 1000,
+						help = "Number of documents per partition with -index_workers")
+	parser.add_argument('-serve', action = "store_true",
+						help = "Serve queries over HTTP (/search, /health, /reload) instead")
+	parser.add_argument('-host', default = "127.0.0.1",
+						help = "Host the server listens on")
+	parser.add_argument('-port', type = int, default = 8000,
+						help = "Port the server listens on")
+	parser.add_argument('-query_workers', type = int, default = 0,
+						help = "With -serve, number of processes ranking queries over one shared-memory copy of the index")
+	parser.add_argument('-serve_models', default = "0",
+						help = "Comma-separated models the -query_workers serve, prepared before the index is shared")
+	parser.add_argument('-async_batching', action = "store_true",
+						help = "With -serve, use the asyncio front end that scores queries in micro-batches")
+	parser.add_argument('-max_batch_size', type = int, default = 32,
+						help = "Maximum number of queries per micro-batch")
+	parser.add_argument('-max_wait_ms', type = float, default = 5.0,
+						help = "Maximum time a query waits for its micro-batch to fill")
+	parser.add_argument('-shards', type = int, default = 1,
+						help = "Number of shard processes the documents are partitioned across for custom queries")
+	parser.add_argument('-segments_dir', default = None,
+						help = "Path to a folder holding an updatable index, searched by custom queries")
+	parser.add_argument('-add_docs', default = None,
+						help = "Path to a json file of documents to add to the updatable index")
+	parser.add_argument('-delete_docs', default = None,
+						help = "Comma-separated IDs of documents to delete from the updatable index")
+	parser.add_argument('-cache_dir', default = None,
+						help = "Path to a folder where preprocessed documents and concepts are cached")
+	parser.add_argument('-daat', action = "store_true",
+						help = "Score custom queries document-at-a-time over the postings with MaxScore pruning, "
+						"for large collections (the default sparse matrix product is faster on small ones)")
+	parser.add_argument('-compress_postings', action = "store_true",
+						help = "With -daat, score from delta + variable-byte compressed postings")
+	parser.add_argument('-lsa_k', type = int, default = 300,
+						help = "Number of LSA dimensions")
+	parser.add_argument('-lsa_svd', default = "randomized",
+						help = "SVD used for LSA [randomized|truncated]")
+	parser.add_argument('-esa_top_n', type = int, default = None,
+						help = "Number of strongest concepts kept per term in the ESA index (default: all)")
+	parser.add_argument('-k1', type = float, default = 1.2,
+						help = "BM25 term frequency saturation")
+	parser.add_argument('-b', type = float, default = 0.75,
+						help = "BM25 document length normalization")
+	parser.add_argument('-delta', type = float, default = 1.0,
+						help = "BM25+ lower bound of the score of a matched term")
 
 	# Parse the input arguments
 	args = parser.parse_args()
 
-	# Chooose method(s) to include in the model
-	print("\nChoose-")
-	print("\t0 for basic Vector Space Model")
-	print("\t1 to add Spellcheck to the Vector Space Model")
-	print("\t2 to add QueryExpansion to the Vector Space Model")
-	print("\t3 to add LSA to the Vector Space Model")
-	print("\t4 to add ESA to the Vector Space Model")
-	print("\t5 for our Best Model\n")
-	print("Enter the model number [0/1/2/3/4/5]:", end=" ")
-	model = int(input())
-	method = 'eval'
-	# Choose whether to evaluate the model or compare the model with the VSM
-	if(model != 0):
-		print("Choose what you want to do with the model-")
-		print("\tEnter 'eval' for evaluating the model")
-		print("\tEnter 'comp' for comparing the model with the Vector Space Model")
-		print("What do you want to do with the model?:", end=" ")
-		method = input()
-
-	# Create an instance of the Search Engine
-	searchEngine = SearchEngine(args, model, method)
-
-	# Either handle query from user or evaluate on the complete dataset
-	if args.custom:
-		searchEngine.handleCustomQuery()
+	# Either serve queries over HTTP, only update the updatable index, or choose a model interactively
+	if args.serve:
+		serve(args)
+	elif args.segments_dir and (args.add_docs or args.delete_docs) and not args.custom:
+		SearchEngine(args, 0, 'update').updateSegmentedIndex()
 	else:
-		searchEngine.evaluateDataset()
+		# Chooose method(s) to include in the model, unless given with -model
+		model = args.model
+		if model is None:
+			print("\nChoose-")
+			print("\t0 for basic Vector Space Model")
+			print("\t1 to add Spellcheck to the Vector Space Model")
+			print("\t2 to add QueryExpansion to the Vector Space Model")
+			print("\t3 to add LSA to the Vector Space Model")
+			print("\t4 to add ESA to the Vector Space Model")
+			print("\t5 for our Best Model")
+			print("\t6 for BM25")
+			print("\t7 for BM25+\n")
+			print("Enter the model number [0/1/2/3/4/5/6/7]:", end=" ")
+			model = int(input())
+		method = args.method or 'eval'
+		# Choose whether to evaluate the model or compare the model with the VSM, unless given with -method
+		if(model != 0 and args.method is None and not args.queries_file):
+			print("Choose what you want to do with the model-")
+			print("\tEnter 'eval' for evaluating the model")
+			print("\tEnter 'comp' for comparing the model with the Vector Space Model")
+			print("What do you want to do with the model?:", end=" ")
+			method = input()
+
+		# Create an instance of the Search Engine
+		searchEngine = SearchEngine(args, model, method)
+
+		# Either rank a query file, handle query from user or evaluate on the complete dataset
+		if args.queries_file:
+			searchEngine.rankQueryFile(args.queries_file, args.run_file or args.out_folder + "run.txt",
+				args.depth, args.query_batch_size, args.run_tag)
+		elif args.custom:
+			searchEngine.handleCustomQuery(args.k)
+		else:
+			searchEngine.evaluateDataset()
@@ -0,0 +1,215 @@
+import bisect
+import heapq
+
+import numpy as np
+from compressedPostings import CompressedPostings
+from scipy import sparse
+
+class PostingCursor():
+
+	def __init__(self, docs, weights, query_weight, upper_bound):
+		"""
+		A cursor over the postings of a single query term
+
+		Parameters
+		----------
+		arg1 : sequence
+			The doc indices of the postings, in increasing order
+		arg2 : sequence
+			The normalized weight of the term in each of those docs
+		arg3 : float
+			The weight of the term in the query
+		arg4 : float
+			The largest weight of the term in any doc
+		"""
+
+		self.docs = docs
+		self.weights = weights
+		self.query_weight = query_weight
+		self.upper_bound = query_weight * upper_bound # max score contribution
+		self.position = 0
+
+	def doc(self):
+		"""
+		The current doc index, None once the postings are exhausted
+		"""
+		if self.position < len(self.docs):
+			return self.docs[self.position]
+		return None
+
+	def score(self):
+		"""
+		The score contribution of the term to the current doc
+		"""
+		return self.query_weight * self.weights[self.position]
+
+	def next(self):
+		"""
+		Move to the next posting
+		"""
+		self.position += 1
+
+	def nextGEQ(self, doc):
+		"""
+		Move to the first posting with a doc index >= doc
+		"""
+		self.position = bisect.bisect_left(self.docs, doc, self.position)
+
+
+class MaxScore():
+
+	def __init__(self, index):
+		"""
+		Document-at-a-time top-k retrieval over the postings of an index
+		built by InformationRetrieval, with MaxScore dynamic pruning
+
+		The tfidf weights are divided by the doc norms once here, so that
+		summing the query term contributions of a doc gives its cosine
+		similarity up to the (constant) query norm
+
+		If the index holds compressed postings (see
+		InformationRetrieval.compressPostings), the cursors decode them
+		block by block instead and scale the term counts on the fly
+
+		The normalized weights are only read, so an index published by
+		another process with the arrays of this MaxScore (see arrays) is
+		used without copying them
+
+		Parameters
+		----------
+		arg1 : dict
+			The index, as stored in InformationRetrieval.index
+		"""
+
+		doc_norms = np.asarray(index["doc_norms"])
+		self.compressed = None
+		if "cpostings_data" in index:
+			self.compressed = CompressedPostings(index["cpostings_data"],
+				index["cpostings_block_offsets"], index["cpostings_block_last_docs"],
+				index["cpostings_term_blocks"])
+			self.term_scales = [index["idf"][word] for word in index["corpus"]]
+			with np.errstate(divide='ignore'):
+				doc_scales = np.where(doc_norms > 0, 1/doc_norms, 0)
+			self.doc_scales = doc_scales.tolist()
+			self.indptr = self.compressed.term_blocks # only used to skip terms without postings
+			self.max_weights = np.asarray(index["cpostings_max_weights"])
+			self.num_docs = len(doc_norms)
+			return
+
+		if "maxscore_weights" in index:
+			self.weight_matrix = index["maxscore_weights"]
+			self.max_weights = index["maxscore_max_weights"]
+		else:
+			tfidf = sparse.csc_matrix(index["tfidf"])
+			with np.errstate(divide='ignore', invalid='ignore'):
+				weights = tfidf.data / doc_norms[tfidf.indices]
+			weights[doc_norms[tfidf.indices] == 0] = 0
+			self.weight_matrix = sparse.csc_matrix((weights, tfidf.indices, tfidf.indptr), shape=tfidf.shape)
+
+			# upper bound of the weight of each term
+			self.max_weights = np.zeros(tfidf.shape[1])
+			non_empty = np.diff(tfidf.indptr) > 0
+			self.max_weights[non_empty] = np.maximum.reduceat(weights, tfidf.indptr[:-1][non_empty])
+
+		self.indptr = self.weight_matrix.indptr
+		self.num_docs = self.weight_matrix.shape[0]
+		self.indices = self.weight_matrix.indices
+		self.weights = self.weight_matrix.data
+
+	def arrays(self):
+		"""
+		The arrays built from the uncompressed index, by key, to add to an
+		index shared with other processes (empty for compressed postings,
+		which are already in the index)
+		"""
+		if self.compressed is not None:
+			return {}
+		return {"maxscore_weights" : self.weight_matrix, "maxscore_max_weights" : self.max_weights}
+
+	def cursor(self, term, query_weight):
+		"""
+		A PostingCursor over the postings of a term id
+		"""
+		if self.compressed is not None:
+			return self.compressed.cursor(term, query_weight, self.term_scales[term],
+				self.doc_scales, self.max_weights[term])
+		# converted to lists for the query only, for fast scalar access
+		start, end = self.indptr[term], self.indptr[term + 1]
+		return PostingCursor(self.indices[start:end].tolist(), self.weights[start:end].tolist(),
+			query_weight, self.max_weights[term])
+
+	def topK(self, terms, query_weights, k):
+		"""
+		The exact top k docs of a query by cosine similarity
+
+		Parameters
+		----------
+		arg1 : list
+			The term ids of the query
+		arg2 : list
+			The tfidf weight of each of those terms in the query
+		arg3 : int
+			The number of docs to return
+
+		Returns
+		-------
+		list
+			A list of (doc index, score) pairs, best first. Docs that share
+			no term with the query are not returned
+		"""
+
+		query_norm = np.linalg.norm(query_weights)
+		cursors = [self.cursor(term, weight) for term, weight in zip(terms, query_weights)
+			if weight > 0 and self.indptr[term + 1] > self.indptr[term]]
+		if k <= 0 or len(cursors) == 0:
+			return []
+
+		# increasing upper bounds; prefix_bounds[i] bounds the score from cursors[:i+1]
+		cursors.sort(key=lambda cursor: cursor.upper_bound)
+		prefix_bounds = np.cumsum([cursor.upper_bound for cursor in cursors]).tolist()
+
+		# min-heap of the current top k (score, doc); among equal scores the
+		# larger doc index ranks higher, as in InformationRetrieval.topK
+		heap = []
+		threshold = 0
+		first_essential = 0 # cursors[:first_essential] alone cannot enter the top k
+
+		while True:
+			# next candidate - smallest doc among the essential cursors
+			doc = None
+			for cursor in cursors[first_essential:]:
+				cursor_doc = cursor.doc()
+				if cursor_doc is not None and (doc is None or cursor_doc < doc):
+					doc = cursor_doc
+			if doc is None:
+				break
+
+			score = 0
+			for cursor in cursors[first_essential:]:
+				if cursor.doc() == doc:
+					score += cursor.score()
+					cursor.next()
+
+			# non-essential cursors, stopping as soon as the doc cannot make it
+			for i in range(first_essential - 1, -1, -1):
+				if score + prefix_bounds[i] < threshold:
+					break
+				cursor = cursors[i]
+				cursor.nextGEQ(doc)
+				if cursor.doc() == doc:
+					score += cursor.score()
+
+			if len(heap) < k:
+				heapq.heappush(heap, (score, doc))
+			elif score >= threshold: # docs come in increasing order, so a tie ranks higher
+				heapq.heapreplace(heap, (score, doc))
+			else:
+				continue
+
+			if len(heap) == k:
+				threshold = heap[0][0]
+				while first_essential < len(cursors) and prefix_bounds[first_essential] < threshold:
+					first_essential += 1
+
+		top = sorted(heap, reverse=True)
+		return [(doc, score/query_norm) for score, doc in top]
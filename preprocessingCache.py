@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from util import TokenizedDocs, Vocabulary
+
+# Bumped whenever the preprocessing code changes its output
+CACHE_VERSION = 1
+
+class PreprocessingCache():
+
+	def __init__(self, cache_dir):
+		"""
+		A cache of preprocessed corpora, addressed by a hash of the input file
+		contents and of the preprocessing configuration
+
+		Each entry is a folder holding the vocabulary of the corpus and its
+		documents as flat int32 arrays of token ids, with the offsets of the
+		sentences in the tokens and of the documents in the sentences
+
+		Parameters
+		----------
+		arg1 : str
+			Path to the cache folder
+		"""
+		self.cache_dir = cache_dir
+
+	def key(self, path, config):
+		"""
+		The cache key of a file preprocessed with a configuration
+
+		Parameters
+		----------
+		arg1 : str
+			Path to the input file
+		arg2 : dict
+			The preprocessing configuration (segmenter, tokenizer, ...)
+		Returns
+		-------
+		str
+			The hex sha256 of the file contents and of the configuration
+		"""
+
+		digest = hashlib.sha256()
+		with open(path, 'rb') as fin:
+			for chunk in iter(lambda: fin.read(1 << 20), b""):
+				digest.update(chunk)
+		config = dict(config, cache_version=CACHE_VERSION)
+		digest.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+		return digest.hexdigest()
+
+	def load(self, key):
+		"""
+		Loads a cached preprocessed corpus
+
+		Parameters
+		----------
+		arg1 : str
+			The cache key
+		Returns
+		-------
+		TokenizedDocs
+			The documents, with the token IDs memory-mapped. Iterating over it
+			decodes them one at a time. None if the key is not cached
+		"""
+
+		entry_dir = os.path.join(self.cache_dir, key)
+		if not os.path.isdir(entry_dir):
+			return None
+
+		vocabulary = Vocabulary(json.load(open(os.path.join(entry_dir, "vocabulary.json"), 'r')))
+		tokens = np.load(os.path.join(entry_dir, "tokens.npy"), mmap_mode='r')
+		sentence_offsets = np.load(os.path.join(entry_dir, "sentence_offsets.npy"))
+		doc_offsets = np.load(os.path.join(entry_dir, "doc_offsets.npy"))
+
+		return TokenizedDocs.fromArrays(vocabulary, tokens, sentence_offsets, doc_offsets)
+
+	def record(self, key, docs):
+		"""
+		Passes the preprocessed documents through while encoding them,
+		and stores them under key once they have all been consumed
+
+		Parameters
+		----------
+		arg1 : str
+			The cache key
+		arg2 : iterable
+			The preprocessed documents, as lists of lists of tokens
+		Returns
+		-------
+		generator
+			The same documents
+		"""
+
+		tokenizedDocs = TokenizedDocs()
+		for doc in docs:
+			tokenizedDocs.add(doc)
+			yield doc
+
+		# written to a temporary folder first, so that a partial entry is never read
+		entry_dir = os.path.join(self.cache_dir, key)
+		tmp_dir = entry_dir + ".tmp"
+		if os.path.isdir(tmp_dir):
+			shutil.rmtree(tmp_dir)
+		os.makedirs(tmp_dir)
+		tokens, sentence_offsets, doc_offsets = tokenizedDocs.arrays()
+		with open(os.path.join(tmp_dir, "vocabulary.json"), 'w') as fout:
+			json.dump(tokenizedDocs.vocabulary.terms, fout)
+		np.save(os.path.join(tmp_dir, "tokens.npy"), tokens)
+		np.save(os.path.join(tmp_dir, "sentence_offsets.npy"), sentence_offsets)
+		np.save(os.path.join(tmp_dir, "doc_offsets.npy"), doc_offsets)
+		if os.path.isdir(entry_dir):
+			shutil.rmtree(entry_dir)
+		os.rename(tmp_dir, entry_dir)
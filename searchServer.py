@@ -0,0 +1,398 @@
+import json
+from multiprocessing import Pool
+import threading
+import time
+
+from sharedIndex import SharedIndex
+
+try:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+	from socketserver import ThreadingMixIn
+	from urllib.parse import parse_qs, urlparse
+except ImportError: # Python 2
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+	from SocketServer import ThreadingMixIn
+	from urlparse import parse_qs, urlparse
+
+# The models that can be asked for, see SearchEngine
+MODELS = range(8)
+
+class ModelNotServedError(Exception):
+	"""
+	Raised for a query with a model the serving state does not serve
+	"""
+	pass
+
+class RetiredStateError(Exception):
+	"""
+	Raised for a query that reached a serving state after a reload
+	replaced it, to be answered by the new state instead
+	"""
+	pass
+
+
+def parseSearchParams(params):
+	"""
+	The query, k and model of the parameters of a /search request, as
+	parsed by parse_qs. Raises ValueError if they are not valid
+	"""
+
+	query = params.get("q", [""])[0]
+	try:
+		k = int(params.get("k", ["5"])[0])
+		model = int(params.get("model", ["0"])[0])
+	except ValueError:
+		raise ValueError("k and model must be integers")
+	if query.strip() == "":
+		raise ValueError("missing query q")
+	if k <= 0 or model not in MODELS:
+		raise ValueError("k must be positive and model in 0-7")
+	return query, k, model
+
+
+class ServingState():
+
+	def __init__(self, createEngine):
+		"""
+		The document index and the search engines of each model that serve
+		queries with it. The index is loaded (or built) once, and what a
+		model adds to it (LSA, ESA, BM25) is prepared on its first query
+
+		Parameters
+		----------
+		arg1 : function
+			Creates the SearchEngine of a model number
+		"""
+
+		self.createEngine = createEngine
+		engine = createEngine(0)
+		engine.buildDocsIndex()
+		self.index = engine.informationRetriever.index
+		self.engines = {0 : engine}
+		engine.prepareModel()
+		self.loaded_at = time.time()
+		self.lock = threading.Lock() # preparing models and ranking are serialized
+
+	def engine(self, model):
+		"""
+		The SearchEngine of a model, sharing the document index
+		"""
+
+		with self.lock:
+			if model not in self.engines:
+				engine = self.createEngine(model)
+				engine.informationRetriever.index = self.index
+				engine.prepareModel()
+				self.engines[model] = engine
+			return self.engines[model]
+
+	def search(self, query, k, model):
+		"""
+		The IDs of the top k documents for a raw query
+		"""
+		return self.searchBatch([query], [k], model)[0]
+
+	def searchBatch(self, queries, ks, model):
+		"""
+		The IDs of the top documents for a batch of raw queries, all
+		scored by a single matrix product
+
+		Parameters
+		----------
+		arg1 : list
+			The queries
+		arg2 : list
+			The number of documents to return for each query
+		arg3 : int
+			The model number
+		Returns
+		-------
+		list
+			The list of document IDs of each query, best first
+		"""
+
+		engine = self.engine(model)
+		# preprocessed outside the lock, with the NLP objects of the engine
+		processedQueries = [engine.getProcessedQueries([query])[0] for query in queries]
+		with self.lock:
+			doc_IDs_ordered = engine.rankQueries(processedQueries, max(ks))
+		return [doc_IDs[:k] for doc_IDs, k in zip(doc_IDs_ordered, ks)]
+
+	def retire(self):
+		"""
+		Called once the state has been replaced by a reload
+		"""
+		pass
+
+
+class WorkerPoolState():
+
+	def __init__(self, createEngine, models, workers, initializer, initargs, searchTask):
+		"""
+		A serving state whose queries are preprocessed and ranked by a pool
+		of worker processes, all attached to one copy of the document index
+		in shared memory (see SharedIndex), so that adding workers does not
+		add copies of the index
+
+		The index is loaded (or built) and prepared for each served model
+		(LSA factors, ESA concept vectors, compressed postings) before it is
+		published, together with what the models rank from (BM25 impacts,
+		MaxScore postings, see InformationRetrieval.sharedArrays), so that
+		the workers do not build them again
+
+		Parameters
+		----------
+		arg1 : function
+			Creates the SearchEngine of a model number
+		arg2 : list
+			The model numbers served
+		arg3 : int
+			Number of worker processes
+		arg4 : function
+			Initializer of a worker, called with initargs and the descriptor
+			of the shared index
+		arg5 : tuple
+			First arguments of the initializer
+		arg6 : function
+			Ranks a (queries, ks, model) task in a worker, see ServingState.searchBatch
+		"""
+
+		engine = createEngine(0)
+		engine.buildDocsIndex()
+		index = engine.informationRetriever.index
+		published = {}
+		for model in models:
+			modelEngine = createEngine(model)
+			modelEngine.informationRetriever.useIndex(index)
+			modelEngine.prepareModel()
+			published.update(modelEngine.informationRetriever.sharedArrays())
+		# published after the models are prepared, which may add to the index
+		published.update(index)
+
+		self.sharedIndex = SharedIndex()
+		descriptor, self.index = self.sharedIndex.publish(published)
+		self.engines = list(models)
+		self.searchTask = searchTask
+		self.pool = Pool(workers, initializer, tuple(initargs) + (descriptor,))
+		self.loaded_at = time.time()
+
+		# the pool and the shared memory are released once retired and idle
+		self.lock = threading.Lock()
+		self.active = 0
+		self.retired = False
+		self.closed = False
+
+	def search(self, query, k, model):
+		"""
+		The IDs of the top k documents for a raw query
+		"""
+		return self.searchBatch([query], [k], model)[0]
+
+	def searchBatch(self, queries, ks, model):
+		"""
+		The IDs of the top documents for a batch of raw queries, ranked by
+		one of the workers, see ServingState.searchBatch
+		"""
+
+		if model not in self.engines:
+			raise ModelNotServedError("model " + str(model) + " is not served by the workers, see -serve_models")
+		with self.lock:
+			# checked with the count of queries in flight, so that the pool is not closed under this query
+			if self.retired:
+				raise RetiredStateError()
+			self.active += 1
+		try:
+			return self.pool.apply(self.searchTask, ((queries, ks, model),))
+		finally:
+			with self.lock:
+				self.active -= 1
+				idle = self.retired and self.active == 0
+			if idle:
+				self.close()
+
+	def retire(self):
+		"""
+		Called once the state has been replaced by a reload - the workers
+		and the shared memory are released after the queries in flight
+		"""
+
+		with self.lock:
+			self.retired = True
+			idle = self.active == 0
+		if idle:
+			self.close()
+
+	def close(self):
+		"""
+		Frees the shared memory and stops the workers. The shared memory is
+		freed first, so that it is not leaked if stopping the workers is
+		interrupted (the workers keep their mappings until they exit)
+		"""
+
+		with self.lock:
+			if self.closed:
+				return
+			self.closed = True
+		try:
+			self.index = None
+			self.sharedIndex.close(unlink=True)
+		finally:
+			self.pool.terminate()
+			self.pool.join()
+
+
+class SearchServer(ThreadingMixIn, HTTPServer):
+
+	daemon_threads = True
+
+	def __init__(self, createEngine, host="127.0.0.1", port=8000, createState=ServingState):
+		"""
+		A local HTTP server answering JSON search requests with an index
+		kept in memory
+
+		- GET /search?q=...&k=...&model=... - the top k (5 by default)
+		  documents for the query with the model (0 by default)
+		- GET /health - the status of the server and of the index
+		- POST (or GET) /reload - loads the index again in the background,
+		  and swaps it in once ready; queries are answered meanwhile
+
+		Parameters
+		----------
+		arg1 : function
+			Creates the SearchEngine of a model number
+		arg2 : str
+			Host to listen on
+		arg3 : int
+			Port to listen on
+		arg4 : function
+			Creates the serving state from createEngine, ServingState or
+			one built on WorkerPoolState
+		"""
+
+		self.createEngine = createEngine
+		self.createState = createState
+		self.state = None
+		self.reload_thread = None
+		self.reload_error = None
+		HTTPServer.__init__(self, (host, port), SearchRequestHandler)
+
+	def load(self):
+		"""
+		Loads the index, and replaces the current one once it is ready
+		"""
+
+		try:
+			state = self.createState(self.createEngine)
+			previous, self.state = self.state, state # in-flight queries keep the state they started with
+			self.reload_error = None
+			if previous is not None:
+				previous.retire()
+		except Exception as error:
+			self.reload_error = str(error)
+			print("Reload failed : " + self.reload_error)
+
+	def reload(self):
+		"""
+		Starts a reload in the background, unless one is running already
+
+		Returns
+		-------
+		boolean
+			True if a reload was started
+		"""
+
+		if self.reload_thread is not None and self.reload_thread.is_alive():
+			return False
+		self.reload_thread = threading.Thread(target=self.load)
+		self.reload_thread.daemon = True
+		self.reload_thread.start()
+		return True
+
+	def health(self):
+		"""
+		The status reported by /health
+		"""
+
+		state = self.state
+		return {
+			"status" : "ok" if state is not None else "loading",
+			"num_docs" : len(state.index["docIDs"]) if state is not None else 0,
+			"loaded_at" : state.loaded_at if state is not None else None,
+			"models_ready" : sorted(state.engines) if state is not None else [],
+			"reloading" : self.reload_thread is not None and self.reload_thread.is_alive(),
+			"last_reload_error" : self.reload_error
+		}
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		if url.path == "/search":
+			self.search(parse_qs(url.query))
+		elif url.path == "/health":
+			self.reply(200, self.server.health())
+		elif url.path == "/reload":
+			self.reloadIndex()
+		else:
+			self.reply(404, {"error" : "unknown path " + url.path})
+
+	def do_POST(self):
+		if urlparse(self.path).path == "/reload":
+			self.reloadIndex()
+		else:
+			self.reply(404, {"error" : "unknown path " + self.path})
+
+	def search(self, params):
+		"""
+		Answers /search?q=...&k=...&model=...
+		"""
+
+		start = time.time()
+		try:
+			query, k, model = parseSearchParams(params)
+		except ValueError as error:
+			return self.reply(400, {"error" : str(error)})
+
+		while True:
+			state = self.server.state
+			if state is None:
+				return self.reply(503, {"error" : "the index is not loaded yet"})
+			try:
+				doc_IDs = state.search(query, k, model)
+				break
+			except RetiredStateError:
+				continue # replaced by a reload meanwhile, asked again to the new state
+			except ModelNotServedError as error:
+				return self.reply(400, {"error" : str(error)})
+			except Exception as error:
+				return self.reply(500, {"error" : str(error)})
+		self.reply(200, {
+			"query" : query,
+			"model" : model,
+			"k" : k,
+			"results" : doc_IDs,
+			"took_ms" : round(1000 * (time.time() - start), 3)
+		})
+
+	def reloadIndex(self):
+		"""
+		Answers /reload
+		"""
+
+		if self.server.reload():
+			self.reply(202, {"status" : "reloading"})
+		else:
+			self.reply(409, {"status" : "a reload is already running"})
+
+	def reply(self, code, body):
+		"""
+		Sends a JSON response
+		"""
+
+		data = json.dumps(body).encode("utf-8")
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
@@ -0,0 +1,510 @@
+from collections import Counter
+import json
+import math
+import os
+import shutil
+import threading
+
+import numpy as np
+from scipy import sparse
+import scipy.sparse.linalg
+from informationRetrieval import InformationRetrieval
+from util import Vocabulary
+
+# Bumped whenever the layout of the segments folder changes
+SEGMENTS_VERSION = 2
+
+class Segment():
+
+	def __init__(self, tf, docIDs, deleted=None):
+		"""
+		An immutable batch of documents of a SegmentedIndex
+
+		Parameters
+		----------
+		arg1 : sparse matrix
+			The (docs x terms) term counts, CSR, with the term IDs of the
+			vocabulary of the index (only the terms known when the segment
+			was built, later terms have no column)
+		arg2 : list
+			The IDs of the documents
+		arg3 : array
+			The tombstones - True for the deleted documents
+		"""
+
+		self.tf = tf
+		self.docIDs = list(docIDs)
+		self.deleted = deleted if deleted is not None else np.zeros(len(self.docIDs), dtype=bool)
+		self.norms = None
+		self.norms_version = None
+		# the folder the segment was saved to, and the tombstones file
+		# matching its saved number of deletions, None until saved
+		self.name = None
+		self.tombstones = None
+		self.saved_deletions = 0
+
+	def docNorms(self, idf, version):
+		"""
+		The tfidf norms of the documents under the current idf, recomputed
+		only when the collection statistics have changed
+		"""
+
+		if self.norms_version != version:
+			idf = idf[:self.tf.shape[1]]
+			self.norms = np.sqrt(self.tf.power(2).dot(idf ** 2))
+			self.norms_version = version
+		return self.norms
+
+	def termIDs(self, row):
+		"""
+		The term IDs of a document of the segment
+		"""
+		return self.tf.indices[self.tf.indptr[row]:self.tf.indptr[row + 1]]
+
+	def __len__(self):
+		return len(self.docIDs)
+
+
+class SegmentedIndex():
+
+	def __init__(self, max_delta_docs=1000, merge_factor=4):
+		"""
+		An index that can be updated without a full rebuild
+
+		New documents go to an in-memory delta segment, which is sealed into
+		an immutable Segment once it holds max_delta_docs documents. Deleted
+		documents are only marked in the tombstones of their segment. When
+		the newest merge_factor segments are of the same size class, they are
+		merged in a background thread, dropping the deleted documents, so
+		that each document is merged about log(N) times
+
+		The document frequencies and the number of live documents are
+		updated with every change, so the idf is always that of the live
+		collection, and a query is scored against every segment
+
+		Parameters
+		----------
+		arg1 : int
+			Number of documents in the delta segment before it is sealed
+		arg2 : int
+			Number of segments of the same size class that triggers a background merge
+		"""
+
+		self.max_delta_docs = max_delta_docs
+		self.merge_factor = merge_factor
+
+		self.vocabulary = Vocabulary()
+		self.df = np.zeros(1024, dtype=np.int64) # document frequencies, with spare capacity
+		self.num_docs = 0 # live documents
+		self.version = 0 # bumped on every change of the statistics
+
+		self.segments = []
+		self.delta = [] # (docID, term ids, term counts) of the new documents
+		self.delta_deleted = []
+		self.delta_segment = None # the delta as a Segment, rebuilt when it changes
+		self.locations = {} # docID -> (segment, row), segment None for the delta
+		self.segments_dir = None # the folder the index was loaded from or saved to
+		self.saved_vocabulary_size = None # number of terms in the vocabulary.json there
+
+		self.lock = threading.RLock()
+		self.merge_thread = None
+		self.ranker = InformationRetrieval()
+
+	@classmethod
+	def fromIndex(cls, index, max_delta_docs=1000, merge_factor=4):
+		"""
+		A SegmentedIndex holding the documents of an index built by
+		InformationRetrieval.buildIndex, as its first segment
+		"""
+
+		segmentedIndex = cls(max_delta_docs, merge_factor)
+		segmentedIndex.vocabulary = Vocabulary(index["corpus"])
+		tf = sparse.csr_matrix(index["tf"])
+		tf.sum_duplicates()
+		segmentedIndex.addSegment(Segment(tf, index["docIDs"]))
+		return segmentedIndex
+
+	def addSegment(self, segment):
+		"""
+		Appends a loaded segment, counting its live documents in the statistics
+		"""
+
+		live = np.nonzero(~segment.deleted)[0]
+		for row in live.tolist():
+			self.locations[segment.docIDs[row]] = (segment, row)
+		self.growStatistics(len(self.vocabulary))
+		live_tf = segment.tf[live]
+		self.df[:live_tf.shape[1]] += np.bincount(live_tf.indices, minlength=live_tf.shape[1])
+		self.num_docs += len(live)
+		self.segments.append(segment)
+		self.version += 1
+
+	def growStatistics(self, num_terms):
+		"""
+		Makes room for num_terms document frequencies
+		"""
+		if num_terms > len(self.df):
+			df = np.zeros(max(num_terms, 2 * len(self.df)), dtype=np.int64)
+			df[:len(self.df)] = self.df
+			self.df = df
+
+	def addDocuments(self, docs, docIDs):
+		"""
+		Adds documents to the delta segment. A document whose ID is already
+		in the index replaces it
+
+		Parameters
+		----------
+		arg1 : iterable
+			A list (or a stream) of lists of lists where each sub-list is
+			a document and each sub-sub-list is a sentence of the document
+		arg2 : list
+			A list of integers denoting IDs of the documents
+		Returns
+		-------
+		None
+		"""
+
+		with self.lock:
+			for doc, docID in zip(docs, docIDs):
+				if docID in self.locations:
+					self.deleteDocuments([docID])
+
+				counts = Counter(word for sentence in doc for word in sentence if word != '.')
+				term_ids = np.array([self.vocabulary.add(word) for word in counts], dtype=np.int32)
+				self.growStatistics(len(self.vocabulary))
+				self.df[term_ids] += 1
+				self.num_docs += 1
+
+				self.locations[docID] = (None, len(self.delta))
+				self.delta.append((docID, term_ids, np.array(list(counts.values()), dtype=np.float64)))
+				self.delta_deleted.append(False)
+				if len(self.delta) >= self.max_delta_docs:
+					self.sealDelta()
+
+			self.version += 1
+			self.delta_segment = None
+
+	def deleteDocuments(self, docIDs):
+		"""
+		Marks documents as deleted, unknown IDs are ignored
+
+		Parameters
+		----------
+		arg1 : list
+			A list of integers denoting IDs of the documents
+		Returns
+		-------
+		None
+		"""
+
+		with self.lock:
+			for docID in docIDs:
+				location = self.locations.pop(docID, None)
+				if location is None:
+					continue
+				segment, row = location
+				if segment is None:
+					self.delta_deleted[row] = True
+					term_ids = self.delta[row][1]
+				else:
+					segment.deleted[row] = True
+					term_ids = segment.termIDs(row)
+				self.df[term_ids] -= 1
+				self.num_docs -= 1
+
+			self.version += 1
+			self.delta_segment = None
+
+	def buildDeltaSegment(self):
+		"""
+		The documents of the delta as a Segment
+		"""
+
+		lengths = [len(term_ids) for docID, term_ids, counts in self.delta]
+		indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+		indices = np.concatenate([term_ids for docID, term_ids, counts in self.delta] + [np.zeros(0, dtype=np.int32)])
+		data = np.concatenate([counts for docID, term_ids, counts in self.delta] + [np.zeros(0)])
+		tf = sparse.csr_matrix((data, indices, indptr), shape=(len(self.delta), len(self.vocabulary)))
+		return Segment(tf, [docID for docID, term_ids, counts in self.delta], np.array(self.delta_deleted, dtype=bool))
+
+	def sealDelta(self):
+		"""
+		Turns the delta into an immutable segment, and starts a background
+		merge if enough segments have piled up
+		"""
+
+		with self.lock:
+			if len(self.delta) == 0:
+				return
+			segment = self.buildDeltaSegment()
+			for row, docID in enumerate(segment.docIDs):
+				if not segment.deleted[row]:
+					self.locations[docID] = (segment, row)
+			self.segments.append(segment)
+			self.delta, self.delta_deleted, self.delta_segment = [], [], None
+			self.maybeMerge()
+
+	def sizeClass(self, segment):
+		"""
+		The size class of a segment - 0 for a sealed delta, 1 once merge_factor
+		of those have been merged, and so on
+		"""
+		size = max(len(segment), 1) / float(self.max_delta_docs)
+		return max(int(math.log(size, self.merge_factor) + 1e-9), 0) if size > 1 else 0
+
+	def mergeCandidates(self):
+		"""
+		The newest run of merge_factor consecutive segments of the same
+		size class, None if there is none
+		"""
+
+		if self.merge_factor < 2:
+			return None
+		for end in range(len(self.segments), self.merge_factor - 1, -1):
+			segments = self.segments[end - self.merge_factor:end]
+			if len(set(self.sizeClass(segment) for segment in segments)) == 1:
+				return segments
+		return None
+
+	def maybeMerge(self):
+		"""
+		Starts the background merge thread if there are segments to
+		merge, unless it is running already
+		"""
+
+		with self.lock:
+			if self.merge_thread is not None or self.mergeCandidates() is None:
+				return
+			self.merge_thread = threading.Thread(target=self.mergeLoop)
+			self.merge_thread.daemon = True
+			self.merge_thread.start()
+
+	def mergeLoop(self):
+		"""
+		Body of the merge thread - merges segments as long as there are
+		candidates, including the segments sealed in the meantime
+		"""
+
+		while True:
+			with self.lock:
+				segments = self.mergeCandidates()
+				if segments is None:
+					self.merge_thread = None
+					return
+			self.mergeSegments(segments)
+
+	def mergeSegments(self, segments):
+		"""
+		Merges consecutive segments into one without their deleted documents,
+		in place of them so that the order of the docs is kept. The
+		tombstones set while merging are carried over to the new segment
+		"""
+
+		with self.lock:
+			rows = [np.nonzero(~segment.deleted)[0] for segment in segments]
+			num_terms = max(segment.tf.shape[1] for segment in segments)
+
+		# the heavy part runs without the lock, over immutable term counts
+		parts = []
+		for segment, live in zip(segments, rows):
+			tf = segment.tf[live]
+			parts.append(sparse.csr_matrix((tf.data, tf.indices, tf.indptr), shape=(len(live), num_terms)))
+		tf = sparse.vstack(parts, format="csr")
+		docIDs = [segment.docIDs[row] for segment, live in zip(segments, rows) for row in live.tolist()]
+
+		with self.lock:
+			deleted = np.concatenate([segment.deleted[live] for segment, live in zip(segments, rows)])
+			merged = Segment(tf, docIDs, deleted)
+			for row, docID in enumerate(docIDs):
+				if not deleted[row]:
+					self.locations[docID] = (merged, row)
+			start = self.segments.index(segments[0])
+			self.segments[start:start + len(segments)] = [merged]
+
+	def waitForMerge(self):
+		"""
+		Waits for the background merges to finish, if they are running
+		"""
+		merge_thread = self.merge_thread
+		if merge_thread is not None:
+			merge_thread.join()
+
+	def idf(self):
+		"""
+		The idf of every term from the live collection statistics,
+		0 for the terms left in no live document
+		"""
+
+		df = self.df[:len(self.vocabulary)]
+		idf = np.zeros(len(df))
+		with np.errstate(divide='ignore'):
+			idf[df > 0] = np.log10(self.num_docs/df[df > 0])
+		return idf
+
+	def rank(self, queries, k=None):
+		"""
+		Rank the live documents of all the segments by tfidf cosine
+		similarity, as InformationRetrieval.rank
+
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of lists where each sub-list is a query and
+			each sub-sub-list is a sentence of the query
+
+		arg2: int
+			The number of documents to return per query, None for a full ranking
+
+		Returns
+		-------
+		list
+			A list of lists of integers where the ith sub-list is a list of IDs
+			of documents in their predicted order of relevance to the ith query
+		"""
+
+		with self.lock:
+			if self.delta_segment is None and len(self.delta) > 0:
+				self.delta_segment = self.buildDeltaSegment()
+			segments = list(self.segments)
+			if self.delta_segment is not None:
+				segments.append(self.delta_segment)
+			idf = self.idf()
+			version = self.version
+			term_ids = self.vocabulary.term_ids
+
+			# tfidf of the queries
+			rows, cols, data = [], [], []
+			for query_index, query in enumerate(queries):
+				for sentence in query:
+					for word in sentence:
+						word = word.lower()
+						if word != '.' and word in term_ids:
+							rows.append(query_index)
+							cols.append(term_ids[word])
+							data.append(idf[term_ids[word]])
+			query_vectors = sparse.coo_matrix((data, (rows, cols)),
+				shape=(len(queries), len(idf)), dtype=np.float64).tocsr()
+			query_norms = sparse.linalg.norm(query_vectors, axis=1)
+
+			# q . d = sum over the terms of q_t * idf_t * tf_dt
+			weighted_queries = query_vectors.multiply(idf).tocsr()
+			all_scores, docIDs = [], []
+			for segment in segments:
+				num_terms = segment.tf.shape[1]
+				dots = np.asarray(weighted_queries[:, :num_terms].dot(segment.tf.T).toarray())
+				doc_norms = segment.docNorms(idf, version)
+				with np.errstate(divide='ignore', invalid='ignore'):
+					cosine_sims = dots / np.outer(query_norms, doc_norms)
+				cosine_sims[:, doc_norms == 0] = 0
+				cosine_sims[query_norms == 0, :] = 0
+				live = ~segment.deleted
+				all_scores.append(cosine_sims[:, live])
+				docIDs.extend(np.asarray(segment.docIDs)[live].tolist())
+
+		all_scores = np.hstack(all_scores) if len(all_scores) else np.zeros((len(queries), 0))
+		doc_IDs_ordered = []
+		for scores in all_scores:
+			doc_IDs_ordered.append([docIDs[j] for j in self.ranker.topK(scores, k)])
+		return doc_IDs_ordered
+
+	def save(self, segments_dir):
+		"""
+		Writes the index to a folder - the vocabulary, one folder per segment
+		(term counts and doc IDs), the tombstones of each segment and
+		manifest.json, written last. Segments are immutable, so only the
+		segments not saved yet (sealed or merged since) get a new folder,
+		and only the tombstones that changed are written again. The delta
+		is sealed first, and a running merge is waited for
+		"""
+
+		with self.lock:
+			self.sealDelta()
+		self.waitForMerge()
+
+		with self.lock:
+			if not os.path.isdir(segments_dir):
+				os.makedirs(segments_dir)
+			manifest_path = os.path.join(segments_dir, "manifest.json")
+			previous = json.load(open(manifest_path, 'r')) if os.path.isfile(manifest_path) else {}
+			previous_segments = previous.get("segments", []) if previous.get("version") == SEGMENTS_VERSION else []
+			if os.path.abspath(segments_dir) != self.segments_dir:
+				# the segments were saved to another folder (or not at all)
+				for segment in self.segments:
+					segment.name, segment.tombstones = None, None
+				self.saved_vocabulary_size = None
+				self.segments_dir = os.path.abspath(segments_dir)
+			# new file and folder names, so that the previous manifest stays valid until it is replaced
+			generation = previous.get("generation", 0) + 1 if previous_segments else 0
+
+			if len(self.vocabulary) != self.saved_vocabulary_size:
+				with open(os.path.join(segments_dir, "vocabulary.json.tmp"), 'w') as fout:
+					json.dump(self.vocabulary.terms, fout)
+				os.replace(os.path.join(segments_dir, "vocabulary.json.tmp"), os.path.join(segments_dir, "vocabulary.json"))
+				self.saved_vocabulary_size = len(self.vocabulary)
+
+			entries = []
+			for i, segment in enumerate(self.segments):
+				if segment.name is None:
+					name = "segment" + str(generation) + "_" + str(i)
+					segment_dir = os.path.join(segments_dir, name)
+					shutil.rmtree(segment_dir, ignore_errors=True) # left by an interrupted save
+					os.makedirs(segment_dir)
+					for part in ("data", "indices", "indptr"):
+						np.save(os.path.join(segment_dir, "tf_" + part + ".npy"), getattr(segment.tf, part))
+					with open(os.path.join(segment_dir, "segment.json"), 'w') as fout:
+						json.dump({"docIDs" : segment.docIDs, "shape" : list(segment.tf.shape)}, fout)
+					segment.name, segment.tombstones = name, None
+				deletions = int(segment.deleted.sum())
+				if segment.tombstones is None or deletions != segment.saved_deletions:
+					# tombstones are only ever added, so an unchanged count means unchanged tombstones
+					segment.tombstones = "deleted" + str(generation) + ".npy"
+					np.save(os.path.join(segments_dir, segment.name, segment.tombstones), segment.deleted)
+					segment.saved_deletions = deletions
+				entries.append({"name" : segment.name, "tombstones" : segment.tombstones})
+
+			with open(manifest_path + ".tmp", 'w') as fout:
+				json.dump({"version" : SEGMENTS_VERSION, "generation" : generation, "segments" : entries}, fout)
+			os.replace(manifest_path + ".tmp", manifest_path)
+
+			# the folders and tombstones only the previous manifest referenced
+			current = dict((entry["name"], entry["tombstones"]) for entry in entries)
+			if previous.get("version") != SEGMENTS_VERSION:
+				for name in previous.get("segments", []): # folders of an older layout
+					shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
+			for entry in previous_segments:
+				if entry["name"] not in current:
+					shutil.rmtree(os.path.join(segments_dir, entry["name"]), ignore_errors=True)
+				elif entry["tombstones"] != current[entry["name"]]:
+					os.remove(os.path.join(segments_dir, entry["name"], entry["tombstones"]))
+
+	@classmethod
+	def load(cls, segments_dir, max_delta_docs=1000, merge_factor=4):
+		"""
+		Loads an index written by save, None if there is none of the
+		current version in the folder
+		"""
+
+		manifest_path = os.path.join(segments_dir, "manifest.json")
+		if not os.path.isfile(manifest_path):
+			return None
+		manifest = json.load(open(manifest_path, 'r'))
+		if manifest["version"] != SEGMENTS_VERSION:
+			return None
+
+		segmentedIndex = cls(max_delta_docs, merge_factor)
+		segmentedIndex.vocabulary = Vocabulary(json.load(open(os.path.join(segments_dir, "vocabulary.json"), 'r')))
+		segmentedIndex.segments_dir = os.path.abspath(segments_dir)
+		segmentedIndex.saved_vocabulary_size = len(segmentedIndex.vocabulary)
+		for entry in manifest["segments"]:
+			segment_dir = os.path.join(segments_dir, entry["name"])
+			meta = json.load(open(os.path.join(segment_dir, "segment.json"), 'r'))
+			data, indices, indptr = [np.load(os.path.join(segment_dir, "tf_" + part + ".npy"))
+				for part in ("data", "indices", "indptr")]
+			tf = sparse.csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]))
+			deleted = np.load(os.path.join(segment_dir, entry["tombstones"]))
+			segment = Segment(tf, meta["docIDs"], deleted)
+			segment.name, segment.tombstones = entry["name"], entry["tombstones"]
+			segment.saved_deletions = int(deleted.sum())
+			segmentedIndex.addSegment(segment)
+		return segmentedIndex
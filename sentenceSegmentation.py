@@ -2,6 +2,10 @@ import nltk.data
 
 class SentenceSegmentation():
 
+	def __init__(self):
+		# Punkt model, loaded once on first use
+		self.sent_detector = None
+
 	def naive(self, text):
 		"""
 		Sentence Segmentation using a Naive Approach
@@ -47,8 +51,9 @@ class SentenceSegmentation():
 
 		segmentedText = None
 
-		sent_detector = nltk.data.load('tokenizers/punkt/english.pickle')
+		if self.sent_detector is None:
+			self.sent_detector = nltk.data.load('tokenizers/punkt/english.pickle')
 
-		segmentedText = sent_detector.tokenize(text.strip())
+		segmentedText = self.sent_detector.tokenize(text.strip())
 
 		return segmentedText
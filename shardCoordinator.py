@@ -0,0 +1,312 @@
+from multiprocessing import Pipe, Process
+
+import numpy as np
+from scipy import sparse
+import scipy.sparse.linalg
+from util import Utilities, Vocabulary
+
+class IndexShard():
+
+	def __init__(self):
+		"""
+		The documents of one shard of a ShardCoordinator, held by a worker
+		process. Its tfidf vectors are weighted with the global idf, given
+		by the coordinator once all the shards are built
+		"""
+
+		self.corpus = None
+		self.term_index = None
+		self.tf = None
+		self.tfidf = None
+		self.doc_norms = None
+		self.first_doc = 0
+
+	def build(self, docs, first_doc):
+		"""
+		Builds the postings of the documents of the shard
+
+		Parameters
+		----------
+		arg1 : list
+			The documents, as lists of lists of tokens
+		arg2 : int
+			The global index of the first document of the shard
+		Returns
+		-------
+		list, array
+			The terms of the shard and their document frequencies
+		"""
+
+		postings, corpus = Utilities().inverted_index(docs)
+		self.corpus = corpus
+		self.term_index = {word: word_index for word_index, word in enumerate(corpus)}
+		self.tf = sparse.csc_matrix((postings.tfs, postings.docs, postings.ptr),
+			shape=(postings.num_docs, len(corpus)))
+		self.first_doc = first_doc
+		return corpus, postings.df()
+
+	def setIdf(self, term_ids, idf_values):
+		"""
+		Weights the term counts with the global idf of the terms of the shard
+
+		The columns are reordered by global term id first, so that the sums
+		over the terms of a document run in the same order as in a single
+		index, and give the same floating point results
+
+		Parameters
+		----------
+		arg1 : array
+			The global id of each term of the shard
+		arg2 : array
+			The global idf of each term of the shard
+		Returns
+		-------
+		None
+		"""
+
+		order = np.argsort(term_ids)
+		self.corpus = [self.corpus[i] for i in order.tolist()]
+		self.term_index = {word: word_index for word_index, word in enumerate(self.corpus)}
+		self.tf = sparse.csc_matrix(self.tf[:, order])
+		idf_values = np.asarray(idf_values)[order]
+
+		data = self.tf.data * np.repeat(idf_values, np.diff(self.tf.indptr))
+		self.tfidf = sparse.csc_matrix((data, self.tf.indices, self.tf.indptr),
+			shape=self.tf.shape).tocsr()
+		self.doc_norms = sparse.linalg.norm(self.tfidf, axis=1)
+
+	def search(self, queries, query_norms, k):
+		"""
+		The local top k of a batch of queries
+
+		Parameters
+		----------
+		arg1 : list
+			Each query as a list of (term, tfidf weight) pairs
+		arg2 : array
+			The norms of the full query vectors
+		arg3 : int
+			The number of documents to return per query, None for all
+
+		Returns
+		-------
+		list
+			For each query, the global indices of its top k documents and
+			their cosine similarities, best first (ties by decreasing index)
+		"""
+
+		rows, cols, data = [], [], []
+		for query_index, query in enumerate(queries):
+			for word, weight in query:
+				if word in self.term_index:
+					rows.append(query_index)
+					cols.append(self.term_index[word])
+					data.append(weight)
+		query_vectors = sparse.coo_matrix((data, (rows, cols)),
+			shape=(len(queries), len(self.corpus)), dtype=np.float64).tocsr()
+
+		dots = np.asarray(query_vectors.dot(self.tfidf.T).toarray())
+		with np.errstate(divide='ignore', invalid='ignore'):
+			cosine_sims = dots / np.outer(query_norms, self.doc_norms)
+		# 0 for empty docs and for queries with no term in the corpus (0/0), as in a single index
+		cosine_sims = np.nan_to_num(cosine_sims)
+		cosine_sims[:, self.doc_norms == 0] = 0
+
+		results = []
+		doc_indices = np.arange(len(self.doc_norms)) + self.first_doc
+		for scores in cosine_sims:
+			top = selectTopK(scores, k, doc_indices)
+			results.append((doc_indices[top], scores[top]))
+		return results
+
+
+def selectTopK(scores, k, doc_indices):
+	"""
+	Positions of the k highest scores, best first, ties by decreasing doc
+	index - the order of InformationRetrieval.topK
+	"""
+
+	if k is None or k >= len(scores):
+		candidates = np.arange(len(scores))
+	else:
+		# every doc tied with the kth score is a candidate, so the selection is deterministic
+		threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+		candidates = np.nonzero(scores >= threshold)[0]
+	order = np.lexsort((-doc_indices[candidates], -scores[candidates]))
+	return candidates[order][:k]
+
+
+# Body of a shard worker process - runs the commands of the coordinator
+def serveShard(connection):
+	shard = IndexShard()
+	while True:
+		command, args = connection.recv()
+		if command == "stop":
+			break
+		elif command == "build":
+			connection.send(shard.build(*args))
+		elif command == "idf":
+			shard.setIdf(*args)
+			connection.send(None)
+		elif command == "search":
+			connection.send(shard.search(*args))
+	connection.close()
+
+
+class ShardCoordinator():
+
+	def __init__(self, num_shards):
+		"""
+		Scatter-gather tfidf ranking over documents partitioned across
+		shards, each held by its own worker process
+
+		The coordinator keeps the global vocabulary and idf only. A batch of
+		queries is turned into (term, tfidf weight) pairs with the global idf
+		and sent to every shard, each shard returns its local top k, and
+		these are merged into the global top k. The scores are those of
+		InformationRetrieval.rank over the whole collection
+
+		Parameters
+		----------
+		arg1 : int
+			Number of shards (worker processes)
+		"""
+
+		self.num_shards = num_shards
+		self.connections = []
+		self.processes = []
+		self.docIDs = None
+		self.idf = None
+
+	def start(self):
+		"""
+		Starts the shard worker processes
+		"""
+
+		for shard_index in range(self.num_shards):
+			connection, worker_connection = Pipe()
+			process = Process(target=serveShard, args=(worker_connection,))
+			process.daemon = True
+			process.start()
+			self.connections.append(connection)
+			self.processes.append(process)
+
+	def stop(self):
+		"""
+		Stops the shard worker processes
+		"""
+
+		for connection in self.connections:
+			connection.send(("stop", ()))
+		for process in self.processes:
+			process.join()
+		self.connections, self.processes = [], []
+
+	def scatter(self, command, shard_args):
+		"""
+		Sends a command to every shard, then gathers their replies in shard order
+		"""
+
+		for connection, args in zip(self.connections, shard_args):
+			connection.send((command, args))
+		return [connection.recv() for connection in self.connections]
+
+	def buildIndex(self, docs, docIDs):
+		"""
+		Partitions the documents into contiguous shards, builds them, and
+		computes the global idf from the document frequencies of the shards
+
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of lists where each sub-list is a document and
+			each sub-sub-list is a sentence of the document
+		arg2 : list
+			A list of integers denoting IDs of the documents
+		Returns
+		-------
+		None
+		"""
+
+		if len(self.processes) == 0:
+			self.start()
+
+		docs = list(docs)
+		self.docIDs = list(docIDs)
+		bounds = np.linspace(0, len(docs), self.num_shards + 1).astype(int).tolist()
+		shards = self.scatter("build", [(docs[bounds[i]:bounds[i + 1]], bounds[i])
+			for i in range(self.num_shards)])
+
+		# global vocabulary, in order of first appearance, and document frequencies
+		vocabulary = Vocabulary()
+		df = []
+		shard_term_ids = []
+		for corpus, shard_df in shards:
+			term_ids = [vocabulary.add(word) for word in corpus]
+			df.extend([0] * (len(vocabulary) - len(df)))
+			for term_id, term_df in zip(term_ids, shard_df.tolist()):
+				df[term_id] += term_df
+			shard_term_ids.append(np.array(term_ids, dtype=np.int64))
+
+		self.vocabulary = vocabulary
+		self.idf = np.log10(len(docs)/np.array(df, dtype=np.float64)) if len(df) else np.zeros(0)
+		self.scatter("idf", [(term_ids, self.idf[term_ids]) for term_ids in shard_term_ids])
+
+	def rank(self, queries, k=None):
+		"""
+		Rank the documents of all the shards for each query by tfidf cosine similarity
+
+		Parameters
+		----------
+		arg1 : list
+			A list of lists of lists where each sub-list is a query and
+			each sub-sub-list is a sentence of the query
+
+		arg2: int
+			The number of documents to return per query, None for a full ranking
+
+		Returns
+		-------
+		list
+			A list of lists of integers where the ith sub-list is a list of IDs
+			of documents in their predicted order of relevance to the ith query
+		"""
+
+		# tfidf of the queries with the global idf, as in InformationRetrieval.queryVectors
+		rows, cols, data = [], [], []
+		for query_index, query in enumerate(queries):
+			for sentence in query:
+				for word in sentence:
+					word = word.lower()
+					term_id = self.vocabulary.get(word)
+					if word != '.' and term_id is not None:
+						rows.append(query_index)
+						cols.append(term_id)
+						data.append(self.idf[term_id])
+		query_vectors = sparse.coo_matrix((data, (rows, cols)),
+			shape=(len(queries), len(self.vocabulary)), dtype=np.float64).tocsr()
+		query_norms = sparse.linalg.norm(query_vectors, axis=1)
+
+		terms = self.vocabulary.terms
+		weighted_terms = []
+		for query_index in range(len(queries)):
+			start, end = query_vectors.indptr[query_index], query_vectors.indptr[query_index + 1]
+			weighted_terms.append([(terms[term_id], weight) for term_id, weight in
+				zip(query_vectors.indices[start:end].tolist(), query_vectors.data[start:end].tolist())])
+
+		shard_results = self.scatter("search", [(weighted_terms, query_norms, k)] * self.num_shards)
+
+		# merge of the local top k lists
+		doc_IDs_ordered = []
+		for query_index in range(len(queries)):
+			doc_indices = np.concatenate([results[query_index][0] for results in shard_results])
+			scores = np.concatenate([results[query_index][1] for results in shard_results])
+			if k is None:
+				# full ranking - all the scores, sorted as in InformationRetrieval.topK
+				all_scores = np.zeros(len(self.docIDs))
+				all_scores[doc_indices] = scores
+				top_docs = np.argsort(all_scores, kind="stable")[::-1]
+			else:
+				top_docs = doc_indices[selectTopK(scores, k, doc_indices)]
+			doc_IDs_ordered.append([self.docIDs[j] for j in top_docs.tolist()])
+		return doc_IDs_ordered
@@ -0,0 +1,116 @@
+from multiprocessing import Pool
+
+import numpy as np
+from util import Postings, Utilities, Vocabulary
+
+class ShardedIndexer():
+
+	def __init__(self, workers, partition_size=1000):
+		"""
+		Builds the postings of a stream of documents in parallel
+
+		The stream is cut into contiguous partitions of partition_size
+		documents, each partition is inverted in its own process of a pool
+		of workers, and the partial postings are merged in partition order.
+		Terms keep their order of first appearance and the docs of a
+		partition all come after those of the previous ones, so the result
+		is identical to Utilities.inverted_index
+
+		Parameters
+		----------
+		arg1 : int
+			Number of worker processes
+		arg2 : int
+			Number of documents per partition
+		"""
+
+		self.workers = workers
+		self.partition_size = partition_size
+
+	def partitions(self, docs):
+		"""
+		Cuts a stream of documents into lists of partition_size documents
+		"""
+
+		partition = []
+		for doc in docs:
+			partition.append(doc)
+			if len(partition) == self.partition_size:
+				yield partition
+				partition = []
+		if len(partition) > 0:
+			yield partition
+
+	def inverted_index(self, docs):
+		"""
+		Builds the postings of a stream of documents, see Utilities.inverted_index
+
+		Parameters
+		----------
+		arg1 : iterable
+			A list (or a stream) of lists of lists where each sub-list is
+			a document and each sub-sub-list is a sentence of the document.
+			It is iterated only once
+
+		Returns
+		-------
+		Postings, list
+			- Postings: parallel int32 arrays of doc indices (0-indexed)
+                    and term counts, grouped by term (in corpus order)
+
+			- list: A list of all the terms in the corpus, in order of first appearance
+		"""
+
+		pool = Pool(self.workers)
+		try:
+			# imap returns the partitions in order while the next ones are being inverted
+			postings, corpus = self.merge(pool.imap(invertPartition, self.partitions(docs)))
+		finally:
+			pool.terminate()
+
+		Utilities.corpus = corpus
+		return postings, corpus
+
+	def merge(self, partitions):
+		"""
+		Merges partial postings, given in partition order
+
+		Parameters
+		----------
+		arg1 : iterable
+			(corpus, Postings) of each partition, see Utilities.inverted_index
+
+		Returns
+		-------
+		Postings, list
+			The postings and the terms of the whole collection
+		"""
+
+		vocabulary = Vocabulary()
+		terms, docs, tfs = [], [], []
+		num_docs = 0
+		for corpus, postings in partitions:
+			# local term columns -> global term ids, new terms appended in local order
+			term_ids = np.array([vocabulary.add(word) for word in corpus], dtype=np.int64)
+			terms.append(np.repeat(term_ids, postings.df()))
+			docs.append(np.asarray(postings.docs, dtype=np.int64) + num_docs)
+			tfs.append(np.asarray(postings.tfs, dtype=np.int32))
+			num_docs += postings.num_docs
+
+		terms = np.concatenate(terms + [np.zeros(0, dtype=np.int64)])
+		docs = np.concatenate(docs + [np.zeros(0, dtype=np.int64)])
+		tfs = np.concatenate(tfs + [np.zeros(0, dtype=np.int32)])
+
+		# the document frequencies are the sums of those of the partitions
+		df = np.bincount(terms, minlength=len(vocabulary))
+		ptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+		# stable - the postings of a term stay in partition order, so the docs stay increasing
+		order = np.argsort(terms, kind="stable")
+
+		return Postings(ptr, docs[order].astype(np.int32), tfs[order], num_docs), vocabulary.terms
+
+
+# Inverts a partition in a worker process of ShardedIndexer
+def invertPartition(partition):
+	postings, corpus = Utilities().inverted_index(partition)
+	return corpus, postings
@@ -0,0 +1,150 @@
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from scipy import sparse
+
+class SharedIndex():
+
+	def __init__(self):
+		"""
+		The numeric arrays of an index built by InformationRetrieval, in
+		shared memory blocks that other processes attach to without copying
+
+		The publishing process creates the blocks with publish, which
+		returns a picklable descriptor. Worker processes pass it to attach
+		to get an index whose arrays (doc vectors, norms, idf, LSA factors,
+		ESA concept vectors, ...) are views of the same memory. Only the
+		vocabulary and the doc IDs are copied into each process
+		"""
+
+		self.blocks = []
+
+	def publish(self, index):
+		"""
+		Copies the arrays of an index to shared memory
+
+		Parameters
+		----------
+		arg1 : dict
+			The index, as stored in InformationRetrieval.index
+		Returns
+		-------
+		dict, dict
+			The descriptor to pass to attach, and the index with its arrays
+			replaced by views of the shared memory, so that the publishing
+			process can drop its own copy
+		"""
+
+		corpus = index["corpus"]
+		descriptor = {
+			"corpus" : corpus,
+			"docIDs" : index["docIDs"],
+			"entries" : {}
+		}
+		arrays = dict((key, value) for key, value in index.items()
+			if key not in ("corpus", "term_index", "idf", "docIDs"))
+		arrays["idf"] = np.array([index["idf"][word] for word in corpus], dtype=np.float64)
+
+		for key, value in arrays.items():
+			if sparse.issparse(value):
+				descriptor["entries"][key] = {
+					"format" : value.format,
+					"shape" : list(value.shape),
+					"parts" : dict((part, self.share(getattr(value, part))) for part in ("data", "indices", "indptr"))
+				}
+			else:
+				descriptor["entries"][key] = {"format" : "array", "array" : self.share(np.asarray(value))}
+
+		return descriptor, self.views(descriptor)
+
+	def share(self, array):
+		"""
+		Copies an array to a new shared memory block, returns its description
+		"""
+
+		block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+		self.blocks.append(block)
+		np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+		return {"name" : block.name, "dtype" : array.dtype.str, "shape" : list(array.shape)}
+
+	@classmethod
+	def attach(cls, descriptor):
+		"""
+		Attaches to the shared memory of a published index
+
+		Parameters
+		----------
+		arg1 : dict
+			The descriptor returned by publish
+		Returns
+		-------
+		SharedIndex, dict
+			The attached blocks, to keep while the index is used, and the index
+		"""
+
+		sharedIndex = cls()
+		for entry in descriptor["entries"].values():
+			for array in ([entry["array"]] if entry["format"] == "array" else entry["parts"].values()):
+				sharedIndex.blocks.append(attachBlock(array["name"]))
+		return sharedIndex, sharedIndex.views(descriptor)
+
+	def views(self, descriptor):
+		"""
+		The index of a descriptor, with arrays backed by the blocks
+		"""
+
+		blocks = dict((block.name, block) for block in self.blocks)
+
+		def view(array):
+			return np.ndarray(tuple(array["shape"]), dtype=np.dtype(array["dtype"]),
+				buffer=blocks[array["name"]].buf)
+
+		corpus = descriptor["corpus"]
+		index = {
+			"corpus" : corpus,
+			"term_index" : {word: word_index for word_index, word in enumerate(corpus)},
+			"docIDs" : descriptor["docIDs"]
+		}
+		for key, entry in descriptor["entries"].items():
+			if entry["format"] == "array":
+				index[key] = view(entry["array"])
+				continue
+			data, indices, indptr = [view(entry["parts"][part]) for part in ("data", "indices", "indptr")]
+			matrix_type = sparse.csr_matrix if entry["format"] == "csr" else sparse.csc_matrix
+			index[key] = matrix_type((data, indices, indptr), shape=tuple(entry["shape"]), copy=False)
+		index["idf"] = dict(zip(corpus, index["idf"].tolist()))
+
+		return index
+
+	def close(self, unlink=False):
+		"""
+		Detaches from the blocks, and frees them if unlink is True (in the
+		publishing process, once no worker uses them anymore)
+		"""
+
+		for block in self.blocks:
+			if unlink:
+				block.unlink()
+			try:
+				block.close()
+			except BufferError:
+				pass # views of the block are still referenced, it is unmapped with them
+		self.blocks = []
+
+
+def attachBlock(name):
+	"""
+	Opens an existing shared memory block without registering it with the
+	resource tracker - only the publishing process, which unlinks the
+	block, keeps it registered
+	"""
+
+	try:
+		return shared_memory.SharedMemory(name=name, track=False)
+	except TypeError: # before Python 3.13, opening a block always registers it
+		register = resource_tracker.register
+		resource_tracker.register = lambda name, rtype: None if rtype == "shared_memory" else register(name, rtype)
+		try:
+			return shared_memory.SharedMemory(name=name)
+		finally:
+			resource_tracker.register = register
@@ -6,6 +6,9 @@ from spellchecker import SpellChecker
 
 class SpellCheck():
 
+    def __init__(self):
+        self.spell = None # the SpellChecker, its dictionary is loaded on the first query only
+
     def correctQuery(self, query):
         """
 		Spelling corrections on each query
@@ -20,7 +23,9 @@ class SpellCheck():
 		string
 			The query after correcting spelling errors in it
 		"""
-        spell = SpellChecker()
+        if self.spell is None:
+            self.spell = SpellChecker()
+        spell = self.spell
 
         query = query.split()
         corrected_query = ''
@@ -0,0 +1,213 @@
+from array import array
+from collections import Counter
+import heapq
+import json
+import os
+import time
+
+import numpy as np
+from util import Postings, Utilities, Vocabulary
+
+try:
+	import resource
+except ImportError: # not available on Windows
+	resource = None
+
+# Estimated in-memory cost of a posting (doc index and term count, int32
+# each) and of a term of the current block (dict entry and its two arrays)
+POSTING_BYTES = 8
+TERM_BYTES = 200
+
+class SPIMIIndexer():
+
+	def __init__(self, index_dir, memory_budget, report_every=10000):
+		"""
+		Single-pass in-memory indexing of a stream of documents, for corpora
+		whose postings do not fit in memory
+
+		The postings are accumulated per term until their estimated size
+		reaches the memory budget, then written to disk as a run sorted by
+		term. Once all the documents are read, the runs are merged (k-way)
+		into the final postings, which are memory-mapped from index_dir.
+		Only the vocabulary is kept in memory for the whole corpus
+
+		The budget bounds the postings of the current block only, not the
+		index that InformationRetrieval.buildIndex then builds from the
+		merged postings (tf and tfidf matrices, norms) in memory
+
+		Terms get their IDs in order of first appearance, and the docs of
+		a run all come after those of the previous runs, so the result is
+		the same as Utilities.inverted_index
+
+		Parameters
+		----------
+		arg1 : str
+			Path to the folder for the runs and the merged postings
+		arg2 : int
+			The memory budget of the postings of a block, in bytes
+		arg3 : int
+			Print the progress every report_every documents
+		"""
+
+		self.index_dir = index_dir
+		self.memory_budget = memory_budget
+		self.report_every = report_every
+		self.runs = [] # path prefixes of the runs written so far
+		self.peak_block_bytes = 0
+
+	def inverted_index(self, docs):
+		"""
+		Builds the postings of a stream of documents, see Utilities.inverted_index
+
+		Parameters
+		----------
+		arg1 : iterable
+			A list (or a stream) of lists of lists where each sub-list is
+			a document and each sub-sub-list is a sentence of the document.
+			It is iterated only once
+
+		Returns
+		-------
+		Postings, list
+			- Postings: the merged postings, memory-mapped from index_dir
+			- list: A list of all the terms in the corpus, in order of first appearance
+		"""
+
+		if not os.path.isdir(self.index_dir):
+			os.makedirs(self.index_dir)
+
+		start_time = time.time()
+		vocabulary = Vocabulary()
+		self.runs = []
+		self.peak_block_bytes = 0
+
+		block = {} # term id -> (doc indices, term counts)
+		block_bytes = 0
+		num_docs = 0
+		for doc in docs:
+			counts = Counter(word for sentence in doc for word in sentence if word != '.')
+			for word, count in counts.items():
+				term_id = vocabulary.add(word)
+				postings = block.get(term_id)
+				if postings is None:
+					postings = block[term_id] = (array('i'), array('i'))
+					block_bytes += TERM_BYTES
+				postings[0].append(num_docs)
+				postings[1].append(count)
+				block_bytes += POSTING_BYTES
+			num_docs += 1
+
+			self.peak_block_bytes = max(self.peak_block_bytes, block_bytes)
+			if block_bytes >= self.memory_budget:
+				self.flushRun(block)
+				block, block_bytes = {}, 0
+			if self.report_every and num_docs % self.report_every == 0:
+				self.report("Indexed " + str(num_docs) + " documents", start_time)
+
+		if len(block) > 0 or len(self.runs) == 0:
+			self.flushRun(block)
+		self.report("Indexed " + str(num_docs) + " documents", start_time)
+
+		postings = self.mergeRuns(len(vocabulary), num_docs)
+		corpus = vocabulary.terms
+		with open(os.path.join(self.index_dir, "vocabulary.json.tmp"), 'w') as fout:
+			json.dump(corpus, fout)
+		os.replace(os.path.join(self.index_dir, "vocabulary.json.tmp"), os.path.join(self.index_dir, "vocabulary.json"))
+		Utilities.corpus = corpus
+		self.report("Merged " + str(len(self.runs)) + " runs into " + str(len(postings.docs)) +
+			" postings of " + str(len(corpus)) + " terms", start_time)
+
+		return postings, corpus
+
+	def flushRun(self, block):
+		"""
+		Writes the postings of a block to disk, sorted by term id
+		"""
+
+		term_ids = np.array(sorted(block), dtype=np.int32)
+		lengths = np.array([len(block[term_id][0]) for term_id in term_ids.tolist()], dtype=np.int64)
+		ptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+		docs = np.empty(ptr[-1], dtype=np.int32)
+		tfs = np.empty(ptr[-1], dtype=np.int32)
+		for i, term_id in enumerate(term_ids.tolist()):
+			docs[ptr[i]:ptr[i + 1]] = block[term_id][0]
+			tfs[ptr[i]:ptr[i + 1]] = block[term_id][1]
+
+		run = os.path.join(self.index_dir, "run" + str(len(self.runs)))
+		for name, values in (("terms", term_ids), ("ptr", ptr), ("docs", docs), ("tfs", tfs)):
+			np.save(run + "_" + name + ".npy", values)
+		self.runs.append(run)
+		print("Flushed run " + str(len(self.runs) - 1) + " : " + str(len(term_ids)) + " terms, " +
+			str(len(docs)) + " postings")
+
+	def mergeRuns(self, num_terms, num_docs):
+		"""
+		k-way merge of the runs into postings_ptr.npy, postings_docs.npy
+		and postings_tfs.npy, then deletes the runs
+
+		Returns
+		-------
+		Postings
+			The merged postings, memory-mapped
+		"""
+
+		runs = []
+		for run in self.runs:
+			runs.append([np.load(run + "_" + name + ".npy", mmap_mode='r')
+				for name in ("terms", "ptr", "docs", "tfs")])
+
+		# the terms of each run, as (term id, run, start, end) in increasing order; for
+		# the same term, the runs come in order, so the doc indices stay increasing
+		def runTerms(run_index):
+			terms, ptr = runs[run_index][0], runs[run_index][1]
+			for i, term_id in enumerate(terms.tolist()):
+				yield term_id, run_index, int(ptr[i]), int(ptr[i + 1])
+
+		# written to temporary files, then moved into place, so that the postings of
+		# a previous build stay valid while something still has them memory-mapped
+		num_postings = sum(int(run[1][-1]) for run in runs)
+		docs = np.lib.format.open_memmap(os.path.join(self.index_dir, "postings_docs.npy.tmp"),
+			mode='w+', dtype=np.int32, shape=(num_postings,))
+		tfs = np.lib.format.open_memmap(os.path.join(self.index_dir, "postings_tfs.npy.tmp"),
+			mode='w+', dtype=np.int32, shape=(num_postings,))
+		lengths = np.zeros(num_terms, dtype=np.int64)
+
+		position = 0
+		for term_id, run_index, start, end in heapq.merge(*[runTerms(i) for i in range(len(runs))]):
+			docs[position:position + end - start] = runs[run_index][2][start:end]
+			tfs[position:position + end - start] = runs[run_index][3][start:end]
+			lengths[term_id] += end - start
+			position += end - start
+
+		ptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+		docs.flush()
+		tfs.flush()
+		del docs, tfs
+		runs = None # unmaps the runs before they are deleted
+		with open(os.path.join(self.index_dir, "postings_ptr.npy.tmp"), 'wb') as fout:
+			np.save(fout, ptr)
+		for name in ("ptr", "docs", "tfs"):
+			path = os.path.join(self.index_dir, "postings_" + name + ".npy")
+			os.replace(path + ".tmp", path)
+
+		for run in self.runs:
+			for name in ("terms", "ptr", "docs", "tfs"):
+				os.remove(run + "_" + name + ".npy")
+
+		return Postings(ptr,
+			np.load(os.path.join(self.index_dir, "postings_docs.npy"), mmap_mode='r'),
+			np.load(os.path.join(self.index_dir, "postings_tfs.npy"), mmap_mode='r'),
+			num_docs)
+
+	def report(self, message, start_time):
+		"""
+		Print the progress, with the elapsed time, the largest block of
+		postings held before a flush and the peak RSS of the process
+		"""
+
+		line = message + " - " + str(round(time.time() - start_time, 1)) + "s, largest block before a flush : " + \
+			str(self.peak_block_bytes // 1024) + " KB"
+		if resource is not None:
+			# ru_maxrss is in KB on Linux
+			line += ", peak RSS : " + str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) + " KB"
+		print(line)
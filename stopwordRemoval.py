@@ -7,6 +7,9 @@ from nltk.corpus import wordnet
 
 class StopwordRemoval():
 
+	def __init__(self):
+		self.stop_words = set(stopwords.words('english'))
+
 	def fromList(self, text, doQueryExpansion=False):
 		"""
 		Sentence Segmentation using the Punkt Tokenizer
@@ -32,7 +35,7 @@ class StopwordRemoval():
 
 		#Fill in code here
 		stopwordRemovedText = []
-		stop_words = set(stopwords.words('english'))
+		stop_words = self.stop_words
 		for sentence in text:
 			filtered_sentence = [word.lower() for word in sentence if not word in stop_words] # changing the case
 			stopwordRemovedText.append(filtered_sentence)
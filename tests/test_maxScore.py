@@ -0,0 +1,32 @@
+import pytest
+
+from informationRetrieval import InformationRetrieval
+
+# docs 1 and 3, 2 and 4, 5 and 6 and 7 are identical, so their scores tie
+docs = [
+	[["cat", "sat", "."]],
+	[["dog", "ran", "."]],
+	[["cat", "sat", "."]],
+	[["dog", "ran", "."]],
+	[["cat", "dog", "."]],
+	[["cat", "dog", "."]],
+	[["cat", "dog", "."]],
+	[["bird", "sang", "."]],
+]
+docIDs = [1, 2, 3, 4, 5, 6, 7, 8]
+queries = [
+	[["cat", "."]],
+	[["dog", "."]],
+	[["cat", "dog", "."]],
+	[["sat", "ran", "."]],
+	[["zzz_oov", "."]],
+]
+
+@pytest.mark.parametrize("compressed", [False, True])
+@pytest.mark.parametrize("k", [1, 2, 3, 5, 8])
+def test_rankPruned_matches_rank_on_ties(compressed, k):
+	ir = InformationRetrieval()
+	ir.buildIndex(docs, docIDs, False)
+	if compressed:
+		ir.compressPostings()
+	assert ir.rankPruned(queries, k) == ir.rank(queries, False, False, k)
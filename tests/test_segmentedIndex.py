@@ -0,0 +1,30 @@
+from informationRetrieval import InformationRetrieval
+from segmentedIndex import SegmentedIndex
+
+docs = [
+	[["the", "cat", "sat", "."]],
+	[["the", "dog", "ran", "."]],
+	[["a", "cat", "and", "a", "dog", "."]],
+	[["birds", "fly", "."]],
+]
+docIDs = [1, 2, 3, 4]
+
+def segmentedIndex():
+	ir = InformationRetrieval()
+	ir.buildIndex(docs[:2], docIDs[:2], False)
+	si = SegmentedIndex.fromIndex(ir.index, max_delta_docs=10)
+	si.addDocuments(docs[2:], docIDs[2:])
+	return si
+
+def test_out_of_vocabulary_query():
+	si = segmentedIndex()
+	# every document scores 0, ranked like InformationRetrieval.rank
+	assert si.rank([[["zzz_oov"]]], 3) == [[4, 3, 2]]
+	assert si.rank([[["zzz_oov"]]]) == [[4, 3, 2, 1]]
+
+def test_matches_single_index():
+	si = segmentedIndex()
+	ir = InformationRetrieval()
+	ir.buildIndex(docs, docIDs, False)
+	queries = [[["cat", "."]], [["dog", "zzz_oov", "."]]]
+	assert si.rank(queries) == ir.rank(queries, False, False)
@@ -2,6 +2,9 @@ from nltk.tokenize import TreebankWordTokenizer
 
 class Tokenization():
 
+	def __init__(self):
+		self.treebankTokenizer = TreebankWordTokenizer()
+
 	def naive(self, text):
 		"""
 		Tokenization using a Naive Approach
@@ -47,7 +50,7 @@ class Tokenization():
 		
 		tokenizedText = []
 		for sentence in text:
-			words = TreebankWordTokenizer().tokenize(sentence)
+			words = self.treebankTokenizer.tokenize(sentence)
 			tokenizedText.append(words)
 
 		return tokenizedText
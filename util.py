@@ -1,82 +1,203 @@
-class Utilities():
+from array import array
 
-    corpus = None # accessible to all class instances
+import numpy as np
 
-    def inverted_index(self, docs):
+
+class Vocabulary():
+
+    def __init__(self, terms=None):
         """
-		Representing the terms in corpus in terms of docs as inverted index
+		Interns terms to integer IDs, in order of first insertion
 
 		Parameters
 		----------
 		arg1 : list
-			A list of lists of lists where each sub-list is
-			a document and each sub-sub-list is a sentence of the document
+			Terms to add, in order (optional)
+		"""
+        self.terms = [] # id -> term
+        self.term_ids = {} # term -> id
+        for term in terms or []:
+            self.add(term)
 
-		Returns
-		-------
-		dict, list
-			- dict: Each key is a term in the corpus.
-                    Each value is an array (arr) of length 2
-                    Where arr[0] represents the doc_ID in which the term is present
-                    And arr[1] represents the number of times the term appeared in that document
+    def add(self, term):
+        """
+		Returns the ID of the term, adding it first if it is new
+		"""
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.term_ids[term] = term_id
+            self.terms.append(term)
+        return term_id
+
+    def get(self, term):
+        """
+		Returns the ID of the term, None if it is not in the vocabulary
+		"""
+        return self.term_ids.get(term)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def __getitem__(self, term_id):
+        return self.terms[term_id]
+
+    def __len__(self):
+        return len(self.terms)
 
-			- list: A list of all the terms in the corpus
+
+class TokenizedDocs():
+
+    def __init__(self, vocabulary=None):
+        """
+		Documents stored as one flat buffer of int32 token IDs, with the
+		offsets of the sentences in the tokens and of the documents in the
+		sentences, instead of lists of lists of strings
+
+		Iterating over it yields the documents as lists of lists of
+		strings, one at a time
+
+		Parameters
+		----------
+		arg1 : Vocabulary
+			The vocabulary to intern the tokens in (optional, it can be
+			shared between several collections)
+		"""
+        self.vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+        self.tokens = array('i')
+        self.sentence_offsets = array('q', [0])
+        self.doc_offsets = array('q', [0])
+
+    @classmethod
+    def fromArrays(cls, vocabulary, tokens, sentence_offsets, doc_offsets):
+        """
+		Wraps existing arrays (for example memory-mapped ones), see arrays()
+		"""
+        docs = cls(vocabulary)
+        docs.tokens = tokens
+        docs.sentence_offsets = sentence_offsets
+        docs.doc_offsets = doc_offsets
+        return docs
+
+    def add(self, doc):
+        """
+		Appends a document given as a list of lists of tokens
+		"""
+        for sentence in doc:
+            for word in sentence:
+                self.tokens.append(self.vocabulary.add(word))
+            self.sentence_offsets.append(len(self.tokens))
+        self.doc_offsets.append(len(self.sentence_offsets) - 1)
+
+    def extend(self, docs):
+        """
+		Appends all the documents of an iterable, returns self
 		"""
-        inv_index={}
-        corpus = []
-        doc_index = 1
         for doc in docs:
-            for sentence in doc:
-                for word in sentence:
-                    if word != '.' and word not in corpus:
-                        corpus.append(word)
-                    if word != '.':
-                        if word not in inv_index:
-                            inv_index[word] = [[doc_index,0]]
-                        if inv_index[word][-1][0] == doc_index:
-                            inv_index[word][-1][1] += 1
-                        else:
-                            inv_index[word].append([doc_index,1])
-            doc_index += 1
-
-            Utilities.corpus = corpus
-
-        return inv_index, corpus
-
-    def concepts_inverted_index(self, concepts):
+            self.add(doc)
+        return self
+
+    def doc(self, doc_index):
+        """
+		The document at doc_index, as a list of lists of tokens
+		"""
+        terms = self.vocabulary.terms
+        doc = []
+        for sentence_index in range(self.doc_offsets[doc_index], self.doc_offsets[doc_index + 1]):
+            start, end = self.sentence_offsets[sentence_index], self.sentence_offsets[sentence_index + 1]
+            doc.append([terms[token] for token in self.tokens[start:end].tolist()])
+        return doc
+
+    def arrays(self):
+        """
+		The token IDs (int32), sentence offsets and document offsets (int64)
+		as numpy arrays, without copying
+		"""
+        return np.asarray(self.tokens, dtype=np.int32), \
+            np.asarray(self.sentence_offsets, dtype=np.int64), \
+            np.asarray(self.doc_offsets, dtype=np.int64)
+
+    def __iter__(self):
+        for doc_index in range(len(self)):
+            yield self.doc(doc_index)
+
+    def __len__(self):
+        return len(self.doc_offsets) - 1
+
+
+class Postings():
+
+    def __init__(self, ptr, docs, tfs, num_docs):
+        """
+		An inverted index as parallel arrays - the postings of the term
+		with column t are docs[ptr[t]:ptr[t+1]] (int32 doc indices, in
+		increasing order) and tfs[ptr[t]:ptr[t+1]] (int32 term counts)
+		"""
+        self.ptr = ptr
+        self.docs = docs
+        self.tfs = tfs
+        self.num_docs = num_docs
+
+    def __getitem__(self, term_index):
+        start, end = self.ptr[term_index], self.ptr[term_index + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+    def df(self):
+        """
+		The document frequency of every term
+		"""
+        return np.diff(self.ptr)
+
+
+class Utilities():
+
+    corpus = None # accessible to all class instances
+
+    def inverted_index(self, docs):
         """
-		Representing the terms in corpus in terms of concepts as inverted index
+		Representing the terms in corpus in terms of docs as inverted index
 
 		Parameters
 		----------
-		arg1 : list
-			A list of lists of lists where each sub-list is
-			a concept (wikipedia article) and each sub-sub-list is a sentence of the concept
+		arg1 : iterable
+			A TokenizedDocs, or a list (or a stream) of lists of lists where
+			each sub-list is a document and each sub-sub-list is a sentence
+			of the document
 
 		Returns
 		-------
-		dict
-			- dict: Each key is a term in the corpus.
-                    Each value is an array (arr) of length 2
-                    Where arr[0] represents the concept_ID in which the term is present
-                    And arr[1] represents the number of times the term appeared in that concept
+		Postings, list
+			- Postings: parallel int32 arrays of doc indices (0-indexed)
+                    and term counts, grouped by term (in corpus order)
 
+			- list: A list of all the terms in the corpus, in order of first appearance
 		"""
+        if not isinstance(docs, TokenizedDocs):
+            docs = TokenizedDocs().extend(docs)
+
+        tokens, sentence_offsets, doc_offsets = docs.arrays()
+        num_docs = len(docs)
+
+        # doc index of every token
+        doc_lengths = np.diff(sentence_offsets[doc_offsets])
+        token_docs = np.repeat(np.arange(num_docs, dtype=np.int64), doc_lengths)
+
+        # the '.' tokens are not terms
+        dot_id = docs.vocabulary.get('.')
+        if dot_id is not None:
+            keep = tokens != dot_id
+            tokens, token_docs = tokens[keep], token_docs[keep]
+
+        # columns - the terms that occur, in vocabulary order
+        term_ids, columns = np.unique(tokens, return_inverse=True)
+
+        # (term, doc) pairs sorted by term, then doc, with their counts
+        pairs, tfs = np.unique(columns.astype(np.int64) * max(num_docs, 1) + token_docs, return_counts=True)
+        pair_terms = pairs // max(num_docs, 1)
+        ptr = np.searchsorted(pair_terms, np.arange(len(term_ids) + 1)).astype(np.int64)
+        postings = Postings(ptr, (pairs % max(num_docs, 1)).astype(np.int32), tfs.astype(np.int32), num_docs)
+
+        corpus = [docs.vocabulary.terms[term_id] for term_id in term_ids.tolist()]
+        Utilities.corpus = corpus
 
-        corpus = Utilities.corpus
-        concepts_inv_index = {}
-        concept_index = 1
-        for concept in concepts:
-            for sentence in concept:
-                words = list(set.intersection(set(corpus), set(sentence)))
-                for word in words:
-                    if word != '.':
-                        if word not in concepts_inv_index:
-                            concepts_inv_index[word] = [[concept_index,0]]
-                        if concepts_inv_index[word][-1][0] == concept_index:
-                            concepts_inv_index[word][-1][1] += 1
-                        else:
-                            concepts_inv_index[word].append([concept_index, 1])
-            concept_index += 1
-
-        return concepts_inv_index
+        return postings, corpus